@@ -11,6 +11,13 @@ functions:
 
     * get_metadata - returns a dataframe containing metadata from iwls given the station_id
     * get_all_metadata - returns a dataframe containing metadata from iwls and from key value pairs given the station_id    
+    * get_status_many - returns the status of many stations, swept concurrently and cached briefly
+    * get_modems_many - returns the modems of many stations, fetched in batches and cached
+    * get_modem_table - returns a table of the modems (ip address, phone number) of many stations
+    * get_station_keys_many - returns the key values of many stations, in bulk where possible
+    * sync_station_keys - bring the key values of many stations to a desired state (dry run report by default)
+    * get_key_values_table - returns the key values of the stations of an environment as a long table
+    * audit_key_values - compares the key values of the stations between environments
     * get_station_id - returns the station id given the station_code
     * get_stations_df - returns a dataframe of stations given the region
     * get_stations_list_private - gets all stations using the private api    
@@ -19,14 +26,28 @@ functions:
     * get_height_code - returns height code from height id
     * get_height_id - returns height id from height code
     * get_height_types - returns dataframe of height types
+    * get_height_types_index - returns cached id <-> code dicts of the height types
+    * map_height_codes - returns the height codes for a series of height type ids
     * find_data_gaps - returns dataframe of data gaps from start to end date for a station
-    * get_metadata_class - convert dictionary of metadata to a class object
+    * get_metadata_class - convert dictionary of metadata to a class object (StationRecord)
+    * StationRecord - shared station type for the public api stations, to_df for a dataframe of a list
+    * StationMetaData - slotted station metadata, from_dict / from_dicts to build from metadata dicts, to_dict / toJSON
     * get_metadata_rest - get metadata for a station using the public REST service
     * get_station_timeseries - returns station data from production api 
     * get_crc_hex_string - returns Modbus 16 CRC calculation
     * create_messages_for_iwls - Create list of messages to send to IWLS
     * send_messages_to_IWLS - Send list of messages to IWLS
-    * get_timeseries_id - gets the timeseries id for a station id with the private api
+    * send_messages_to_IWLS_bulk - Send list of messages to IWLS concurrently, returns status per message
+    * mount_connection_pool - sizes the connection pool of a session shared by max_workers threads
+    * get_station_region_map - returns region / region header of all stations from two bulk calls
+    * get_station_region - returns the region code of a station from the station region map
+    * get_timeseries_id - gets the timeseries id for a station id with the private api (from the directory)
+    * build_timeseries_directory - gets the timeseries ids for many stations at the same time and keeps them
+    * pack_messages - create messages to send to IWLS bounded by a byte / row limit
+    * get_metadata_from_xml_many - get_metadata_from_xml for many stations, the xml is parsed once
+    * merge_messages - merge small messages for the same station into fewer messages
+    * get_sensor_map_from_logger - sensor map from the .bas file(s), each only downloaded when its DIR listing changed
+    * get_logbook_entries_many - returns the logbook entries of many stations, fetched at the same time page by page
     STILL HAVE TO ADD IN ALL THE NEW METHODS !!!
 
 """
@@ -42,6 +63,12 @@ import socket
 import telnetlib
 import logging
 import json
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
 
 ##--------------------------------------------------------------------------------
 """
@@ -60,6 +87,25 @@ s.encoding = 'utf-8'
 s.chunked = True
 s.timeout = 10
 s.headers['Accept'] = 'application/json,*/*'
+
+# A session keeps 10 connections per host by default - threads past that open and 
+# drop a connection for each request, so sessions shared by a pool are sized to it 
+connection_pool_lock = threading.Lock()
+
+def mount_connection_pool(session, max_workers):
+    """
+    Size the connection pool of a session for max_workers threads (only ever made bigger)
+    return:
+        the session
+    """
+    with connection_pool_lock:
+        if getattr(session, 'pool_maxsize', 10) >= max_workers:
+            return session
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.pool_maxsize = max_workers
+    return session
 ##--------------------------------------------------------------------------------
 
 # Placeholders for caching station metadata
@@ -71,84 +117,155 @@ list_regions = []
 # Add code to merge IWLS metadata with key value pairs 
 # ---------------------------------------------------------------------------------------
 class StationMetaData:
+    # 2026-10-19 Slotted - one slot per field instead of a __dict__ per object, this 
+    # matters when the metadata for all the stations of the network is kept around.
+    # Keys that are not fields (new key value pairs) still work, they go in a 
+    # __dict__ that is only created when needed
+
+    # Field: type - lists default to [] (copied for each object), the rest to ''
+    # The multi value and True / False key values are strings until parsed (see from_dict)
+    active: str
+    basic_file_name: str
+    chsRegionCode: str
+    chsRegionId: str
+    classCode: str
+    code: str
+    commissioningDate: str
+    contact: str
+    data_logger: str
+    dateOfCommissioning: str
+    datums: list
+    dcp: str
+    description: str
+    disseminated: str
+    established: str
+    establishedYear: str
+    expectedProductivityPerHour: str
+    externalId: str
+    externalOrganizationId: str
+    goes_enabled: Union[str, bool]
+    goes_iwls_sensors: Union[str, list]
+    goes_message_type: str
+    goes_minutes_back: str
+    goes_sutron_sensors: Union[str, list]
+    goes_units: Union[str, list]
+    heights: list
+    ibmCode: str
+    id: str
+    ip_address: str
+    ip_enabled: Union[str, bool]
+    isTidal: str
+    isTideTableReferencePort: str
+    iwls_environment: str
+    iwls_sensors: Union[str, list]
+    lastMaintenanceDate: str
+    latitude: str
+    log_name: str
+    longitude: str
+    modem_enabled: Union[str, bool]
+    name: str
+    officialName: str
+    offset: str
+    operating: Union[str, bool]
+    organizationId: str
+    owner: str
+    phone_number: str
+    port: str
+    previousCode: str
+    provinceCode: str
+    provinceId: str
+    referenceDatums: list
+    referencePort: str
+    region_header: str
+    script_variable_iwls: str
+    script_variable_sensor: str
+    stationClassCode: str
+    status: str
+    sutron_sensors: Union[str, list]
+    tidal: str
+    tideTableId: str
+    timeSeries: list
+    timeZoneCode: str
+    type: str
+    user_login: str
+    user_pass: str
+    version: str
+    voltageCritical: str
+    voltageWarning: str
+
+    # NOTE: Special Cases - backwards compatibility 
+    xconnectlogfile: str
+    ip: str
+
+    FIELDS = {field: [] if field_type is list else '' for field, field_type in __annotations__.items()}
+
+    # Multi value key value pairs (comma separated) and True / False key value pairs
+    LIST_FIELDS = ['iwls_sensors', 'sutron_sensors', 'goes_iwls_sensors', 'goes_sutron_sensors', 'goes_units']
+    BOOL_FIELDS = ['ip_enabled', 'modem_enabled', 'goes_enabled', 'operating']
+
+    __slots__ = tuple(FIELDS) + ('__dict__',)
+
     def __init__(self):
-        self.active = ''
-        self.basic_file_name = ''
-        self.chsRegionCode = ''
-        self.chsRegionId = ''
-        self.classCode = ''
-        self.code = ''
-        self.commissioningDate = ''
-        self.contact = ''
-        self.data_logger=''
-        self.dateOfCommissioning = ''
-        self.datums = []
-        self.dcp=''
-        self.description = ''
-        self.disseminated = '' 
-        self.established = ''
-        self.establishedYear = ''
-        self.expectedProductivityPerHour = ''
-        self.externalId = ''
-        self.externalOrganizationId = ''
-        self.goes_enabled = ''
-        self.goes_iwls_sensors=''
-        self.goes_message_type=''
-        self.goes_minutes_back = ''
-        self.goes_sutron_sensors=''
-        self.goes_units=''
-        self.heights = []
-        self.ibmCode = ''
-        self.id = ''
-        self.ip_address = ''
-        self.ip_enabled = ''
-        self.isTidal = ''
-        self.isTideTableReferencePort = ''
-        self.iwls_environment = ''
-        self.iwls_sensors = ''
-        self.lastMaintenanceDate = ''   
-        self.latitude = ''
-        self.log_name=''
-        self.longitude = ''
-        self.modem_enabled = ''
-        self.name = ''
-        self.officialName = ''
-        self.offset = ''
-        self.operating = ''
-        self.organizationId = ''
-        self.owner = ''
-        self.phone_number = ''
-        self.port = ''
-        self.previousCode = ''
-        self.provinceCode = ''
-        self.provinceId = ''
-        self.referenceDatums = []
-        self.referencePort = ''
-        self.region_header = ''             
-        self.script_variable_iwls = ''
-        self.script_variable_sensor = ''
-        self.stationClassCode = ''
-        self.status = ''
-        self.sutron_sensors = ''
-        self.tidal = ''
-        self.tideTableId = ''
-        self.timeSeries = []
-        self.timeZoneCode = ''
-        self.type = ''
-        self.user_login = ''
-        self.user_pass = ''
-        self.version = ''
-        self.voltageCritical = ''
-        self.voltageWarning = ''      
-
-        # NOTE: Special Cases - backwards compatibility 
-        self.xconnectlogfile = ''
-        self.ip = ''
+        for field, default in self.FIELDS.items():
+            setattr(self, field, list(default) if isinstance(default, list) else default)
+
+    @classmethod
+    def from_dict(cls, metadata: dict, parse=True):
+        """
+        Create the object from a metadata dict (IWLS metadata merged with the key values)
+        params:
+            metadata = dict i.e. from get_station_metadata + get_station_keys
+            parse = split the multi value strings into lists and the True / False 
+                    strings into booleans (only strings are changed). As before, a multi 
+                    value key the station does not have is [''] and a True / False key False
+        return:
+            StationMetaData object
+        """
+        # Each field is set once - no defaults set first and then overwritten 
+        station = cls.__new__(cls)
+        for field, default in cls.FIELDS.items():
+            value = metadata.get(field, default)
+            if value is default and isinstance(default, list):
+                value = []
+            if parse and isinstance(value, str):
+                if field in cls.LIST_FIELDS:
+                    value = value.split(',')
+                elif field in cls.BOOL_FIELDS:
+                    value = string_to_bool(value)
+            setattr(station, field, value)
+
+        # Keys that are not fields 
+        extra = {key: value for key, value in metadata.items() if key not in cls.FIELDS}
+        if extra:
+            station.__dict__.update(extra)
+
+        if parse:
+            # NOTE: special case - backwards compatibility  
+            if 'log_name' in metadata: station.xconnectlogfile = station.log_name
+            if 'ip_address' in metadata: station.ip = station.ip_address
+        return station
+
+    @classmethod
+    def from_dicts(cls, list_metadata: list, parse=True) -> list:
+        """
+        Create the objects for a list of metadata dicts i.e. from get_all_metadata_for_key_value
+        return:
+            list of StationMetaData objects
+        """
+        return [cls.from_dict(metadata, parse) for metadata in list_metadata]
+
+    def to_dict(self) -> dict:
+        d = {field: getattr(self, field) for field in self.FIELDS}
+        d.update(self.__dict__)
+        return d
+
+    @classmethod
+    def to_dicts(cls, stations: list) -> list:
+        return [station.to_dict() for station in stations]
 
     def toJSON(self):
         return json.dumps(
-            self,
-            default=lambda o: o.__dict__, 
+            self.to_dict(),
             sort_keys=True)   
 
     # NOTE: indent parameter causes newlines after each element
@@ -181,6 +298,79 @@ def get_station_status(station_id):
     r = s.get(url=url)
     data_json = r.json()
     return data_json
+
+##--------------------------------------------------------------------------------
+# Status of many stations - swept concurrently and kept for STATION_STATUS_TTL seconds
+# so the gap fill can skip the stations IWLS reports as down without asking each time 
+STATION_STATUS_TTL = 300
+station_status_cache = {}
+station_status_lock = threading.Lock()
+
+def get_status_many(station_ids=None, region=None, max_workers=16, max_per_second=20,
+                    max_age_seconds=STATION_STATUS_TTL):
+    """
+    Status of many stations at the same time 
+    params:
+        station_ids = list of station ids (None for all the stations, or the stations of region)
+        region = region code (ATL,CNA,PAC,QUE) used when station_ids is None
+        max_workers = number of requests at the same time 
+        max_per_second = most requests started per second (rate limit)
+        max_age_seconds = use a cached status if it is not older than this (0 to ask again)
+    return:
+        Pandas dataframe with columns station_id, code, status, checked, error
+        and the other (top level) fields of the status reply
+    """
+    station_regions = get_station_region_map()
+    codes = {station['id']: code for code, station in station_regions.items()}
+    if station_ids is None:
+        station_ids = [station['id'] for station in station_regions.values()
+                       if region is None or station['chsRegionCode'] == region]
+
+    # get_station_status uses the module session 
+    mount_connection_pool(s, max_workers)
+
+    # Rate limit - each request waits for its turn 
+    pacing = {'next': time.monotonic(), 'lock': threading.Lock()}
+    def wait_turn():
+        with pacing['lock']:
+            now = time.monotonic()
+            start = max(now, pacing['next'])
+            pacing['next'] = start + 1.0 / max_per_second
+        if start > now:
+            time.sleep(start - now)
+
+    def get_status(station_id):
+        with station_status_lock:
+            cached = station_status_cache.get(station_id)
+        if cached is not None and time.monotonic() - cached[0] <= max_age_seconds:
+            return cached[1]
+
+        row = {'station_id': station_id, 'code': codes.get(station_id), 'status': None,
+               'checked': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'error': None}
+        try:
+            wait_turn()
+            data_json = get_station_status(station_id)
+            if isinstance(data_json, dict):
+                row.update({key: value for key, value in data_json.items()
+                            if not isinstance(value, (dict, list)) and key not in row})
+                row['status'] = data_json.get('status')
+            else:
+                row['status'] = str(data_json)
+        except Exception as e:
+            # Not kept in the cache - ask again next time 
+            row['error'] = str(e)
+            return row
+
+        with station_status_lock:
+            station_status_cache[station_id] = (time.monotonic(), row)
+        return row
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rows = list(executor.map(get_status, station_ids))
+
+    if not rows:
+        return pd.DataFrame(columns=['station_id','code','status','checked','error'])
+    return pd.DataFrame(rows)
 ##--------------------------------------------------------------------------------
 
 def get_station_id(station_code):
@@ -237,10 +427,9 @@ def get_stations_list(chs_region_code='PAC',time_series_code="wlo"):
     params = {'chs-region-code':chs_region_code,'time-series-code':time_series_code}
     r = s.get(url=station_url, params=params)
     data_json = r.json()
-    list_of_classes = []
-    
-    for station in data_json:
-        list_of_classes +=[get_metadata_class(station)]
+
+    # One StationRecord per station - use StationRecord.to_df(list) for a dataframe 
+    list_of_classes = [StationRecord(station) for station in data_json]
     
     return list_of_classes
 
@@ -284,8 +473,8 @@ def get_height_code(heightTypeId ):
     return:
         Height Code
     """
-    height_types = get_height_types()    
-    code = height_types.loc[height_types.id==heightTypeId].code.values[0]
+    # 2026-10-19 From the cached index instead of getting the height types every call 
+    code = get_height_types_index_lookup('id_to_code', heightTypeId)
 
 
     # params = {}
@@ -304,8 +493,7 @@ def get_height_id(code):
     return:
         unique IWLS database height type id
     """
-    height_types = get_height_types()    
-    id = height_types.loc[height_types.code==code].id.values[0]
+    id = get_height_types_index_lookup('code_to_id', code)
     return id        
 
 ##--------------------------------------------------------------------------------
@@ -324,6 +512,69 @@ def get_height_types():
     df = pd.DataFrame.from_dict(data_json)
     return df
 
+##--------------------------------------------------------------------------------
+# Height types rarely change - they are fetched once into id <-> code dicts and 
+# kept for HEIGHT_TYPES_TTL seconds, shared by all threads 
+HEIGHT_TYPES_TTL = 3600
+# An unknown id / code refreshes the height types at most once per HEIGHT_TYPES_MISS_INTERVAL seconds
+HEIGHT_TYPES_MISS_INTERVAL = 60
+height_types_index = {'loaded': None, 'miss_refresh': None, 'id_to_code': {}, 'code_to_id': {}}
+height_types_lock = threading.Lock()
+
+def get_height_types_index(refresh=False):
+    """
+    Return the height type indexes, from the cache if not older than HEIGHT_TYPES_TTL
+    params:
+        refresh = get the height types from IWLS even if the cache is still good
+    return:
+        dict with id_to_code and code_to_id dicts
+    """
+    with height_types_lock:
+        loaded = height_types_index['loaded']
+        if refresh or loaded is None or time.monotonic() - loaded > HEIGHT_TYPES_TTL:
+            df = get_height_types()
+            height_types_index['id_to_code'] = dict(zip(df['id'], df['code']))
+            height_types_index['code_to_id'] = dict(zip(df['code'], df['id']))
+            height_types_index['loaded'] = time.monotonic()
+        return height_types_index
+
+def get_height_types_index_on_miss():
+    # helper function to get_height_types_index_lookup / map_height_codes
+    # A key we do not know may be a new height type - refresh, but not for every 
+    # lookup of a key that does not exist (a stale id would call IWLS every time)
+    with height_types_lock:
+        last = height_types_index['miss_refresh']
+        if last is not None and time.monotonic() - last < HEIGHT_TYPES_MISS_INTERVAL:
+            return height_types_index
+        height_types_index['miss_refresh'] = time.monotonic()
+    return get_height_types_index(refresh=True)
+
+def get_height_types_index_lookup(index_name, key):
+    # helper function to get_height_code / get_height_id 
+    value = get_height_types_index()[index_name].get(key)
+    if value is None:
+        value = get_height_types_index_on_miss()[index_name].get(key)
+    return value
+
+def map_height_codes(series):
+    """
+    Height codes for a whole series of height type ids at once 
+    i.e. for the heights of a station:
+        df = pd.DataFrame(get_station_heights('07120'))
+        df['code'] = map_height_codes(df['heightTypeId'])
+    params:
+        series = Pandas series (or list) of height type ids
+    return:
+        Pandas series of height codes (NaN where the id is unknown)
+    """
+    series = pd.Series(series)
+    codes = series.map(get_height_types_index()['id_to_code'])
+
+    # Unknown ids - may be new height types 
+    if codes[series.notna()].isna().any():
+        codes = series.map(get_height_types_index_on_miss()['id_to_code'])
+    return codes
+
 ##--------------------------------------------------------------------------------
 
 def find_data_gaps(station_id,time_series_id,start_time,end_time):
@@ -518,7 +769,7 @@ def get_station_timeseries_private(station_code,time_series_code,start_time,end_
     # start_time_stats = time.time()
 
     # Get the station id 
-    station_id = get_station_id_private(station_code)
+    station_id = get_station_id_cached(station_code)
     if station_id is None:
         return None
 
@@ -626,16 +877,39 @@ def get_station_timeseries_private(station_code,time_series_code,start_time,end_
 
 ##--------------------------------------------------------------------------------   
 
+class StationRecord:
+    # 2026-10-19 One shared type for the stations from the public api (was a new class 
+    # created for every station in get_metadata_class). The usual keys have a slot, 
+    # anything else goes in the __dict__ 
+    __slots__ = ('id', 'code', 'officialName', 'operating', 'latitude', 'longitude',
+                 'type', 'timeSeries', '__dict__')
+
+    def __init__(self, station=None):
+        if station is not None:
+            for key, value in station.items():
+                setattr(self, key, value)
+
+    def __repr__(self):
+        return f"StationRecord({getattr(self, 'code', '')} {getattr(self, 'officialName', '')})"
+
+    def to_dict(self) -> dict:
+        d = {key: getattr(self, key) for key in self.__slots__[:-1] if hasattr(self, key)}
+        d.update(self.__dict__)
+        return d
+
+    @classmethod
+    def to_df(cls, stations: list):
+        """
+        Columnar view of a list of stations (i.e. from get_stations_list) to work on 
+        all of them at once 
+        return:
+            Pandas dataframe with one row per station
+        """
+        return pd.DataFrame([station.to_dict() for station in stations])
+
 def get_metadata_class(station):
     #Converts a dictionary of station data to a station class object
-    
-    class station_class:
-        def __init__(self, station=None):
-            if station is not None:
-                for key, value in station.items():
-                    setattr(self, key, value)
-    
-    return station_class(station)
+    return StationRecord(station)
 ##--------------------------------------------------------------------------------
 
 def get_metadata_rest(station_id):
@@ -841,16 +1115,168 @@ def send_messages_to_IWLS(messages,iwls_environment):
     return status_code
 
 ##--------------------------------------------------------------------------------
+# Concurrent bulk sender for integrateRawObservations 
+# Status codes worth another try - anything else is a final answer 
+# ---------------------------------------------------------------------------------------
+IWLS_RETRY_STATUS_CODES = ['408','429','500','502','503','504']
+
+def send_messages_to_IWLS_bulk(messages, iwls_environment, max_workers=8, retries=3, backoff=1.0, timeout=30):
+    """
+    Send a list of messages to IWLS concurrently over one authenticated session 
+    inputs:
+        messages = list of messages i.e. from pack_messages / merge_messages
+        iwls_environment should be one of "dev","test","prod"
+        max_workers = maximum number of posts in flight at the same time
+        retries = number of retries for timeouts, connection errors and IWLS_RETRY_STATUS_CODES
+        backoff = seconds to wait before the first retry, doubled on each retry
+        timeout = seconds to wait for each post
+    return:
+        Pandas dataframe with one row per message (same order as messages)
+           message_index  status_code  success  attempts  latency  response_content
+        0              0        '201'     True         1    0.412  "b''"
+        1              1        '503'    False         4    1.734  "b'Service Unavailable'"
+
+        status_code and response_content are strings, status_code is '' if there was no reply
+
+        Failed messages can be re-sent with messages[i] for i in df.loc[~df.success].message_index
+    """
+    # What return codes indicate success ?
+    codes_success = ['200','201','202']
+
+    # Authenticate once and share the session between the workers 
+    # Size the connection pool so each worker keeps its own connection 
+    session, base_url = get_session_auth(iwls_environment)
+    mount_connection_pool(session, max_workers)
+    url = f"{base_url}/rest/stations/integrateRawObservations"
+
+    def post_message(index):
+        attempts = 0
+        status_code = ''
+        response_content = ''
+        start = time.perf_counter()
+        while attempts <= retries:
+            if attempts > 0:
+                time.sleep(backoff * 2 ** (attempts - 1))
+            attempts += 1
+            try:
+                response = session.post(url, data=messages[index], timeout=timeout,
+                                        headers={'Content-Type':'application/json'})
+                status_code = str(response.status_code)
+                response_content = str(response.content)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                status_code = ''
+                response_content = str(e)
+                continue
+
+            if status_code not in IWLS_RETRY_STATUS_CODES:
+                break
+
+        latency = round(time.perf_counter() - start, 3)
+        logging.info(f'Message {index}: Return Code:{status_code} Attempts:{attempts} Latency:{latency}')
+        return {'message_index': index,
+                'status_code': status_code,
+                'success': status_code in codes_success,
+                'attempts': attempts,
+                'latency': latency,
+                'response_content': response_content}
+
+    # The pool bounds the number of posts in flight 
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(post_message, range(len(messages))))
+
+    df = pd.DataFrame(results, columns=['message_index','status_code','success',
+                                        'attempts','latency','response_content'])
+    return df
+##--------------------------------------------------------------------------------
 
 def get_timeseries_id(station_id, timeseries_code = "wlo"):
 
+    # 2026-10-19 From the time series directory - the listing for the station is 
+    # only fetched once (see build_timeseries_directory)
+    return get_station_timeseries_ids(station_id).get(timeseries_code)
+
+##--------------------------------------------------------------------------------
+# Time series directory - station id: {time series code: time series id}
+# Built for all the stations at once (build_timeseries_directory) or one station 
+# at a time as they are asked for, kept for TIMESERIES_DIRECTORY_TTL seconds 
+TIMESERIES_DIRECTORY_TTL = 21600
+timeseries_directory = {}
+timeseries_directory_lock = threading.Lock()
+
+def get_station_timeseries_ids(station_id, refresh=False) ->dict:
+    """
+    Time series of a station from the directory (fetched if not there or too old)
+    params:
+        station_id = unique IWLS station id i.e. 5cebf1df3d0f4a073c4bbd1e
+        refresh = fetch the listing even if the directory has it
+    return:
+        dict of time series code: time series id i.e. {'wlo': '5cebf1de3d0f4a073c4bb96a', ...}
+    """
+    with timeseries_directory_lock:
+        cached = timeseries_directory.get(station_id)
+    if not refresh and cached is not None and time.monotonic() - cached[0] < TIMESERIES_DIRECTORY_TTL:
+        return cached[1]
+
     url = private_station_url + station_id + '/time-series/'
     r = s.get(url=url)
     data_json = r.json()
-    for timeseries in data_json:
-        if timeseries['code'] == timeseries_code:
-            return timeseries['id']
-    return None
+
+    # Not a list - probably an error, do not keep it 
+    if type(data_json) != list:
+        return {}
+
+    ids = {timeseries['code']: timeseries['id'] for timeseries in data_json}
+    with timeseries_directory_lock:
+        timeseries_directory[station_id] = (time.monotonic(), ids)
+    return ids
+
+def build_timeseries_directory(station_ids=None, max_workers=16, refresh=False) ->dict:
+    """
+    Fill the time series directory for many stations at the same time 
+    params:
+        station_ids = list of station ids (None for all the stations of the private api)
+        max_workers = number of stations fetched at the same time
+        refresh = fetch the listings even if the directory has them
+    return:
+        dict of (station_id, time series code): time series id
+    """
+    if station_ids is None:
+        station_ids = [station['id'] for station in get_stations_list_cached()]
+    # get_station_timeseries_ids uses the module session 
+    mount_connection_pool(s, max_workers)
+
+    def get_ids(station_id):
+        try:
+            return get_station_timeseries_ids(station_id, refresh)
+        except Exception as e:
+            logging.info(f'Time series directory: {station_id} {e}')
+            return {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list_ids = list(executor.map(get_ids, station_ids))
+
+    directory = {}
+    for station_id, ids in zip(station_ids, list_ids):
+        for code, timeseries_id in ids.items():
+            directory[(station_id, code)] = timeseries_id
+    return directory
+
+def get_stations_list_cached() ->list:
+    """
+    All stations from the private api, fetched again when older than STATION_LIST_TTL (list_stations)
+    """
+    get_station_region_map()
+    return list_stations
+
+def get_station_id_cached(station_code):
+    """
+    Station id for a station code from the cached list of stations (get_station_id_private 
+    gets all the stations every call)
+    return:
+        Station ID i.e. code='07120' returns id=5cebf1df3d0f4a073c4bbd1e, None if not found
+    """
+    station = get_station_region_map_lookup(station_code)
+    return None if station is None else station['id']
 
 ##--------------------------------------------------------------------------------
 def send_to_iwls(message,environment):
@@ -906,8 +1332,9 @@ def send_to_iwls(message,environment):
 
     return status_code, response_content
 ##--------------------------------------------------------------------------------
-def get_list_of_queries(df_station_gaps, log_name=None):
+def get_list_of_queries(df_station_gaps, log_name=None, frequency='1D'):
     # Returns a list of queries to be sent to the datalogger
+    # frequency is the longest time span of a single query (pandas frequency string)
 
     # Dataframe looks like this 
     #    start                                     end
@@ -937,7 +1364,7 @@ def get_list_of_queries(df_station_gaps, log_name=None):
     # again open for debate 
     # Frequency:
     # 1D, 6H, 1T (each minute)
-    list_gaps = expand_list_date_range(list_original_gaps,'1D')
+    list_gaps = expand_list_date_range(list_original_gaps,frequency)
 
     # List to hold the queries 
     list_queries = []
@@ -1013,86 +1440,118 @@ def expand_list_date_range(list_dates,frequency):
     list_dates_expanded.sort(key = lambda row: row[0],reverse=True)
     return list_dates_expanded
 ##--------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------
+# Station XML index 
+# The legacy xml config is parsed once into a dict keyed by stationid and kept until 
+# the file changes (modification time / size), instead of parsing the whole file for 
+# every station looked up 
+# ---------------------------------------------------------------------------------------
+xml_station_index = {}
+xml_station_index_lock = threading.Lock()
+
+def get_xml_station_index(xml_file):
+    """
+    Index of the stations in the xml config - parsed once, again when the file changes
+    Streams the file with iterparse so large files are not held as a tree 
+    params:
+        xml_file = path of the xml config 
+    return:
+        dict of stationid: dict of element: text for the station i.e. 
+        {'07120': {'stationid': '07120', 'stationname': 'Victoria', 'ipaddress': ... }}
+        (first station in the file if a stationid is there more than once)
+    """
+    stat = os.stat(xml_file)
+    signature = (stat.st_mtime, stat.st_size)
+    key = os.path.abspath(xml_file)
+
+    with xml_station_index_lock:
+        cached = xml_station_index.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        index = {}
+        depth = 0
+        for event, el in ET.iterparse(xml_file, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+
+            # Only the station elements right under the root i.e. root/station
+            if depth == 1 and el.tag == 'station':
+                fields = {}
+                for child in el:
+                    fields.setdefault(child.tag, child.text)
+                stationid = fields.get('stationid')
+                if stationid is not None and stationid not in index:
+                    index[stationid] = fields
+                el.clear()
+
+        xml_station_index[key] = (signature, index)
+        logging.info(f'Indexed {len(index)} stations from {xml_file}')
+        return index
+
+##--------------------------------------------------------------------------------
 def get_metadata_from_xml(station_id, xml_file):
 
-    # Get as much metadata as we can get for now 
-    station = get_station_class(station_id)
+    # Get the station from the xml index (the file is only parsed again when it changes)
+    el = get_xml_station_index(xml_file).get(station_id)
+    if el is None:
+        return None
 
-    # Open the xml file and add more properties 
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-
-    # Get the particular station
-    is_found = False 
-    for el in root.findall("station/[stationid='%s']" % station_id):
-
-        # Get the elements 
-        is_found = True 
-        stationid = el.find('stationid').text
-        stationname = el.find('stationname').text
-        ipaddress = el.find('ipaddress').text
-        port = el.find('port').text
-        sensors = el.find('sensors').text.split(',')
-        iwlssensors = el.find('iwlssensors').text.split(',')
-        regionheader = el.find('regionheader').text
-        enabled = el.find('enabled').text
-        sensorlog = el.find('logname')
-        if sensorlog != None:
-            sensorlog = sensorlog.text
-        username = el.find('user_login')
-        if username != None:
-            username = username.text
-        userpass = el.find('user_pass')
-        if userpass != None:
-            userpass = userpass.text
-        logger_file_name = el.find('logger_file_name')
-        if logger_file_name != None:
-            logger_file_name = logger_file_name.text
-        script_variable_sensor = el.find('script_variable_sensor')
-        if script_variable_sensor != None:
-            script_variable_sensor = script_variable_sensor.text
-        script_variable_iwls = el.find('script_variable_iwls')
-        if script_variable_iwls != None:
-            script_variable_iwls = script_variable_iwls.text        
-
-        # Add specific properties to the metadata object 
-        station.ip = ipaddress
-        station.port = port 
-        station.sutron_sensors = sensors 
-        station.iwls_sensors = iwlssensors
-        station.region_header = regionheader
-        station.sensor_log = sensorlog
-        station.user_name = username
-        station.user_pass = userpass
-        station.enabled = True if enabled.lower() == 'true' else False
-        station.logger_file_name = logger_file_name
-        station.script_variable_sensor = script_variable_sensor
-        station.script_variable_iwls = script_variable_iwls
-        station.xconnectlogfile = None
-
-
-        # Temporary for testing - Mike 2021-11-24
-        if station.enabled == False:
-            logging.info(f'Not enabled for {stationid} {stationname}')
-            return None
-        else:
-            logging.info(f'Enabled  {stationid} {stationname} {enabled}')
-        # Check for a different logfile (default=SSP.log)
-        xconnectlogfile = el.find('logname')
-        if xconnectlogfile is not None: 
-            xconnectlogfile = el.find('logname').text
-            station.xconnectlogfile = xconnectlogfile
-
-        # Break out of loop - we only want the first station match 
-        break        
-
-    if (station):
-        if (is_found):
-            return station
-        else:
-            return None
+    # Get the elements 
+    stationid = el.get('stationid')
+    stationname = el.get('stationname')
+    enabled = el.get('enabled') or ''
+
+    # Temporary for testing - Mike 2021-11-24
+    if enabled.lower() != 'true':
+        logging.info(f'Not enabled for {stationid} {stationname}')
+        return None
     else:
+        logging.info(f'Enabled  {stationid} {stationname} {enabled}')
+
+    # Get as much metadata as we can get for now 
+    station = get_station_class(station_id)
+    if not station:
         return None
+
+    # Add specific properties to the metadata object 
+    station.ip = el.get('ipaddress')
+    station.port = el.get('port')
+    station.sutron_sensors = (el.get('sensors') or '').split(',')
+    station.iwls_sensors = (el.get('iwlssensors') or '').split(',')
+    station.region_header = el.get('regionheader')
+    station.sensor_log = el.get('logname')
+    station.user_name = el.get('user_login')
+    station.user_pass = el.get('user_pass')
+    station.enabled = True
+    station.logger_file_name = el.get('logger_file_name')
+    station.script_variable_sensor = el.get('script_variable_sensor')
+    station.script_variable_iwls = el.get('script_variable_iwls')
+
+    # Check for a different logfile (default=SSP.log)
+    station.xconnectlogfile = el.get('logname')
+
+    return station
+
+def get_metadata_from_xml_many(station_ids, xml_file, max_workers=8):
+    """
+    get_metadata_from_xml for many stations - the xml is parsed once and the 
+    IWLS metadata for the stations is fetched concurrently 
+    params:
+        station_ids = list of station ids (codes) i.e. ['07120','08615']
+        xml_file = path of the xml config 
+        max_workers = number of stations fetched from IWLS at the same time
+    return:
+        dict of station_id: station object (None if not found or not enabled)
+    """
+    # Parse (or validate) the index once before the workers start
+    get_xml_station_index(xml_file)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        stations = list(executor.map(lambda station_id: get_metadata_from_xml(station_id, xml_file), station_ids))
+    return dict(zip(station_ids, stations))
 ##--------------------------------------------------------------------------------    
 def get_station_class(station_code):
     """
@@ -1111,11 +1570,22 @@ def get_station_class(station_code):
 
     return station
 ##--------------------------------------------------------------------------------
-def get_gap_data_from_station(metadata_dict, list_queries,strike):
+def get_gap_data_from_station(metadata_dict, list_queries,strike, query_callback=None, pacer=None, sensor_map=None,
+                              timings=None):
     # 1. connect to station (authenticate if necessary)
     # 2. update sensor map if necessary
     # 3. get gap data
     # 4. format data and return as df
+    # query_callback (optional) is called with (query, records) for each query 
+    # the logger answered - i.e. to checkpoint the run
+    # pacer (optional) paces the queries for the station - see GapFill_Tools.QueryPacer
+    # pacer.before_query(station_code) is called before each query (may sleep) and 
+    # pacer.after_query(station_code, ok, reply_bytes, seconds) after each query 
+    # sensor_map (optional) cache of the sensor maps parsed from the .bas file - see 
+    # GapFill_Tools.SensorMapCache. On the first strike the .bas file is checked with DIR
+    # and only downloaded again when it changed 
+    # timings (optional) dict - connect_ms is set to the time taken to open the telnet 
+    # connection, i.e. for GapFill_Tools.StationHealth
 
     # Set function variables
     sutron_sensors = metadata_dict.sutron_sensors
@@ -1141,8 +1611,11 @@ def get_gap_data_from_station(metadata_dict, list_queries,strike):
         password = bytes(password, 'utf-8')
 
     # Connect to station (authenticate if necessary)
+    connect_start = time.perf_counter()
     try:
         with telnetlib.Telnet(ipaddress, port) as tn:  
+            if timings is not None:
+                timings['connect_ms'] = round((time.perf_counter() - connect_start) * 1000, 1)
 
             # read_until can have a timeout parameter. Timeout is in seconds 
             timeout = 10 
@@ -1192,6 +1665,23 @@ def get_gap_data_from_station(metadata_dict, list_queries,strike):
             #     # Update metadata object
             #     metadata_dict.sutron_sensors = sutron_sensors
             #     metadata_dict.iwls_sensors = iwls_sensors
+            # 2026-10-19 With a sensor map cache the .bas file is checked again - a DIR listing 
+            # is cheap and the file is only downloaded when it changed. The key value pairs 
+            # are still used if the logger map can not be read 
+            if (sensor_map is not None) and (strike == 0) and basic_file_name:
+                sensors, status = get_sensor_map_from_logger(tn, metadata_dict, sensor_map, timeout)
+
+                if sensors is None:
+                    logging.info(f'{official_name} {station_code}: {status} - using the key value sensors')
+                else:
+                    if list(sensors[0]) != list(sutron_sensors or []):
+                        logging.info(f'{official_name} {station_code}: Sensor map from {basic_file_name} '
+                                     f'{sensors[0]} does not match the key values {sutron_sensors}')
+                    sutron_sensors, iwls_sensors = sensors
+
+                    # Update metadata object
+                    metadata_dict.sutron_sensors = sutron_sensors
+                    metadata_dict.iwls_sensors = iwls_sensors
 
             # Send queries to station to collect data
             logger_list = []
@@ -1209,6 +1699,10 @@ def get_gap_data_from_station(metadata_dict, list_queries,strike):
                 # if x > 9:
                 #     logging.info(f'{official_name} {station_code}: Sleeping for 5 seconds. Query Number:{x}')
                 #     time.sleep(5)
+                # 2026-10-19 Replaced by the optional pacer - it learns the delay for each station
+                if pacer is not None:
+                    pacer.before_query(station_code)
+                query_start = time.perf_counter()
 
                 # Send query to logger
                 tn.write(query)
@@ -1219,6 +1713,8 @@ def get_gap_data_from_station(metadata_dict, list_queries,strike):
                     logging.debug(f'msg: {msg}')
                 
                 except socket.timeout:
+                    if pacer is not None:
+                        pacer.after_query(station_code, False, 0, time.perf_counter() - query_start)
                     # Raise exception for connection failure due to timeout 
                     return None, metadata_dict,f'{official_name} {station_code}: Socket Timeout - Sending query to station'
                 
@@ -1227,6 +1723,14 @@ def get_gap_data_from_station(metadata_dict, list_queries,strike):
                     # Validate through the enforcer function
                     enforced_msg = station_response_enforcer(query, msg, station_code, official_name)
 
+                    if pacer is not None:
+                        pacer.after_query(station_code, enforced_msg is not None, len(reply),
+                                          time.perf_counter() - query_start)
+
+                    # Let the caller know this query was answered (even with no records)
+                    if (enforced_msg is not None) and (query_callback is not None):
+                        query_callback(query, list(enforced_msg))
+
                     # If response if None, message did not pass tests
                     if not enforced_msg:
                         # Go to next query
@@ -1247,8 +1751,11 @@ def get_gap_data_from_station(metadata_dict, list_queries,strike):
 
             formatted_gap_data = gap_data_formatter(logger_list, sutron_sensors)
 
-    except Exception as e:
-        # Error opening the telnet connection 
+    except (OSError, EOFError, socket.timeout) as e:
+        # Error opening (or losing) the telnet connection 
+        # 2026-10-19 Only connection errors - a bug or database error in query_callback, 
+        # pacer or sensor_map is raised, it would look like a dead logger to the station health 
+        logging.info(f'{official_name} {station_code}: Telnet connection error - {e}')
         return None, metadata_dict,'Could not create the Telnet connection'
 
     # Everything is super great - it all worked ! 
@@ -1397,6 +1904,107 @@ def get_gap_data_from_station_OLD_20241205(metadata_dict, list_queries,strike):
     return formatted_gap_data, metadata_dict,'Good'
 
 
+##--------------------------------------------------------------------------------
+def get_file_signature(tn, file_name, timeout=10):
+    """
+    helper function to get_gap_data_from_station
+    DIR listing of a file on the logger - the line holds the size and the 
+    modification time so it changes whenever the file changes
+    params:
+        tn = open telnet connection, at the Flash Disk> prompt
+        file_name = file on the logger i.e. 07120_MEAS_IPtoIWLS.bas
+    return:
+        DIR line for the file (white space normalized), None if the file is not there
+    """
+    tn.write(bytes(f'DIR {file_name}\r\n', 'utf-8'))
+    reply = tn.read_until(b'Flash Disk>', timeout)
+
+    for line in reply.decode('utf-8', errors='ignore').split('\r\n'):
+        # skip the echo of the command itself 
+        if file_name.lower() in line.lower() and 'dir ' not in line.lower():
+            return ' '.join(line.split())
+    return None
+
+##--------------------------------------------------------------------------------
+def get_sensor_map_from_logger(tn, metadata_dict, sensor_map, timeout=10):
+    """
+    helper function to get_gap_data_from_station
+    Sensor map of the station from its .bas push file(s). The cached map of a file is 
+    used as long as the DIR listing of the file did not change, otherwise the file is 
+    downloaded (TYPE ... /C), parsed with get_stations_as_lists and cached again 
+    A station with several push files (basic_file_name = 'a.bas;b.bas') gets the 
+    sensors of all its files, each file checked and cached on its own 
+    params:
+        tn = open telnet connection, at the Flash Disk> prompt
+        metadata_dict = StationMetaData object
+        sensor_map = GapFill_Tools.SensorMapCache (anything with get / put)
+    return:
+        (sutron_sensors, iwls_sensors) or None, status message
+        None if any of the files could not be read - the caller uses the key value sensors 
+    """
+    sutron_sensors = []
+    iwls_sensors = []
+    statuses = []
+    file_names = [f.strip() for f in str(metadata_dict.basic_file_name).split(';') if f.strip()]
+    for basic_file_name in file_names:
+        sensors, status = get_sensor_map_from_file(tn, metadata_dict, basic_file_name, sensor_map, timeout)
+        if sensors is None:
+            if len(file_names) > 1:
+                status = f'{status} ({basic_file_name})'
+            return None, status
+        statuses.append(status)
+
+        # Same sensor in two files - keep it once 
+        for sutron_sensor, iwls_sensor in zip(*sensors):
+            if sutron_sensor not in sutron_sensors:
+                sutron_sensors.append(sutron_sensor)
+                iwls_sensors.append(iwls_sensor)
+
+    if not file_names:
+        return None, 'No push file (.bas) in the key values'
+    status = statuses[0] if len(set(statuses)) == 1 else 'Sensor map from cache and logger'
+    return (sutron_sensors, iwls_sensors), status
+
+def get_sensor_map_from_file(tn, metadata_dict, basic_file_name, sensor_map, timeout=10):
+    """
+    helper function to get_sensor_map_from_logger
+    Sensor map of one .bas push file, from the cache if its DIR listing did not change 
+    return:
+        (sutron_sensors, iwls_sensors) or None, status message
+    """
+    station_code = metadata_dict.code
+
+    try:
+        signature = get_file_signature(tn, basic_file_name, timeout)
+    except socket.timeout:
+        return None, 'Socket Timeout - Getting the basic file listing from logger'
+    if signature is None:
+        return None, 'Push file (.bas) not found in logger'
+
+    cached = sensor_map.get(station_code, basic_file_name, signature)
+    if cached is not None:
+        return cached, 'Sensor map from cache'
+
+    # The file changed (or was never read) - get it 
+    tn.write(bytes(f'TYPE {basic_file_name} /C\r\n', 'utf-8'))
+    try:
+        reply = tn.read_until(b'Flash Disk>', timeout)
+    except socket.timeout:
+        return None, 'Socket Timeout - Getting basic file from logger'
+
+    if 'File not found.' in str(reply):
+        return None, 'Push file (.bas) not found in logger'
+
+    sutron_sensors, iwls_sensors = get_stations_as_lists(
+                reply, metadata_dict.script_variable_sensor, metadata_dict.script_variable_iwls)
+    if not sutron_sensors:
+        return None, f'No sensors found in {basic_file_name}'
+
+    sensor_map.put(station_code, basic_file_name, signature, sutron_sensors, iwls_sensors,
+                   hashlib.sha1(reply).hexdigest())
+    logging.info(f'{metadata_dict.officialName} {station_code}: Sensor map read from {basic_file_name}')
+    return (sutron_sensors, iwls_sensors), 'Sensor map from logger'
+
 ##--------------------------------------------------------------------------------
 def get_stations_as_lists(push_file, script_variable_sensor, script_variable_iwls):
     # helper function to get_gap_data_from_station
@@ -1519,6 +2127,7 @@ def gap_data_formatter(gap_data, list_sensors):
 def create_message(stationid, listsensors, iwlssensors, gap_data, regionheader):
 
     # 2022-01-14 Khaleel - lets split up messages if the dataframe is greater than X in size 
+    # NOTE: See pack_messages below for the size limited version 
 
     # Dataframe looks like this:
     # Sensor       WaterLevelDate       VEGA
@@ -1527,6 +2136,33 @@ def create_message(stationid, listsensors, iwlssensors, gap_data, regionheader):
     # 2       12/22/2021 16:03:00  5.031,m,G
     # 3       12/22/2021 16:04:00  5.036,m,G
 
+    # calculate message header
+    # i.e. $PACIF,07120,WL1,WL2,WL3;
+    header, list_columns = get_message_header(stationid, listsensors, iwlssensors, gap_data, regionheader)
+
+    # Get each gap line from the dataframe and format for IWLS  
+    datalines = get_message_datalines(gap_data, list_columns)
+
+    # Create the message to send 
+    message = build_message(header, datalines)
+    return message 
+
+##--------------------------------------------------------------------------------
+def get_message_header(stationid, listsensors, iwlssensors, gap_data, regionheader):
+    """
+    Create the header of an integrateRawObservations message
+    helper function to create_message and pack_messages
+
+    params:
+        stationid = five digit station code
+        listsensors = list of sutron sensor names ex: ["VR","SU","ENC","PRESA","FTS64-1"]
+        iwlssensors = list of IWLS sensor names in the same order ex:["WL1","WL2","WL3","WL4","WL5"]
+        gap_data = dataframe from gap_data_formatter
+        regionheader = name of the region ex: "CTRAR","ATLAN","PACIF","QUE"
+    return:
+        header i.e. PACIF,07120,WL1,WL2,WL3;
+        list of dataframe columns (sutron sensors) in header order
+    """
     # Filter iwlssensors that are in df
     list_columns = []
     list_iwls_columns = []
@@ -1537,23 +2173,32 @@ def create_message(stationid, listsensors, iwlssensors, gap_data, regionheader):
             sensor_idx = listsensors.index(col)
             iwls_sensor = iwlssensors[sensor_idx]
             list_iwls_columns.append(iwls_sensor)
-    
-    # calculate message header
-    # i.e. $PACIF,07120,WL1,WL2,WL3;
-    line1sensors = ''
 
     # Create the sensor portion of the message header 
     # Only include IWLS sensors, where we have a "matching"
     # sensor name in the columns of the dataframe 
     # Then, if no values (like AC, BAT), they will be replaced with 
     # ",,,"
+    line1sensors = ''
     for sensor in list_iwls_columns:
         line1sensors += ',' + sensor
 
     header = regionheader +  ',' + stationid + line1sensors + ';'
-    datalines = ''
-    
-    # Get each gap line from the dataframe and format for IWLS  
+    return header, list_columns
+
+##--------------------------------------------------------------------------------
+def get_message_datalines(gap_data, list_columns):
+    """
+    Format each row of the gap dataframe as an IWLS data line
+    helper function to create_message and pack_messages
+
+    params:
+        gap_data = dataframe from gap_data_formatter
+        list_columns = list of sensor columns from get_message_header
+    return:
+        list of data lines (no trailing ';')
+        i.e. ['181212,170300,0.565,m,G,0.567,m,G,0.565,m,G', ...]
+    """
     # NOTE: No linefeeds until final line
     # NOTE: Checksum calculated on data between the $ and the *    
     # $PACIF,07120,WL1,WL2,WL3;
@@ -1562,6 +2207,7 @@ def create_message(stationid, listsensors, iwlssensors, gap_data, regionheader):
     # 181212,165700,0.56,m,G,0.562,m,G,0.559,m,G;
     # 181212,165400,0.553,m,G,0.554,m,G,0.552,m,G;
     # *8F56
+    datalines = []
     for index, row in gap_data.iterrows():
         # Convert the date to iwls format 
         water_level_date = datetime.strptime(row['WaterLevelDate'], "%m/%d/%Y %H:%M:%S").strftime("%y%m%d,%H%M%S")
@@ -1584,30 +2230,170 @@ def create_message(stationid, listsensors, iwlssensors, gap_data, regionheader):
                 else:
                     msg += ',,,'
 
-        # Test the last characters as it will be a comma
-        # We want to replace it with a semi colon 
-        # Check we have the proper number of commas in the string 
-        # Should be 2 for the date, and 3 for each reading
+        # The last character will be a comma - remove it, lines 
+        # are joined with a ';' when the message is built 
         if (msg[-1]==','):
-            # Remove it and replace with ;
-            msg = msg[:-1] + ';'
-        datalines += msg
+            msg = msg[:-1]
+        datalines.append(msg)
+
+    return datalines
 
-    # Data ends with a ';'
-    # Need to remove the last ';'
-    if (datalines[-1]==';'):
-        datalines = datalines[:-1]
+##--------------------------------------------------------------------------------
+def build_message(header, datalines):
+    """
+    Join a header and data lines into a message with its checksum
 
+    params:
+        header = header from get_message_header i.e. PACIF,07120,WL1,WL2,WL3;
+        datalines = list of data lines from get_message_datalines
+    return:
+        message i.e. ["$PACIF,07120,WL1;181212,170300,0.565,m,G*8F56"]\r\n
+    """
     # Checksum : the asterisk ending the data fields is followed by a 
     # 4 digit checksum CRC-16 MODBUS. This checksum can be used to ensure 
     # the integrity of the contained message. The CRC is calculated on 
     # all elements of the string between the $ and the asterisk.
-    message = header + datalines
+    message = header + ';'.join(datalines)
     checkSum = get_crc_hex_string(message.encode('utf-8')).upper()
+    return '["$' + message + '*' + checkSum + '"]\r\n'
 
-    # Create the message to send 
-    message = '["$' + message + '*' + checkSum + '"]\r\n'
-    return message 
+##--------------------------------------------------------------------------------
+def split_message(message):
+    """
+    Split a message built by build_message back into header and data lines
+    Used to merge messages, the checksum is dropped as it is recalculated
+
+    params:
+        message = message i.e. ["$PACIF,07120,WL1;181212,170300,0.565,m,G*8F56"]\r\n
+    return:
+        header, list of data lines
+        None, None if the message is not formatted as expected
+    """
+    body = message.strip()
+    if not (body.startswith('["$') and body.endswith('"]')):
+        return None, None
+
+    # Remove the wrapper and the checksum 
+    body = body[3:-2]
+    body = body[:body.rfind('*')]
+
+    # Header ends at the first ';'
+    idx = body.find(';')
+    if idx < 0:
+        return None, None
+    header = body[:idx + 1]
+    datalines = body[idx + 1:].split(';') if body[idx + 1:] else []
+    return header, datalines
+
+##--------------------------------------------------------------------------------
+# Size-aware message packing for integrateRawObservations 
+# Limits for a single post - adjust if the server limits change 
+# ---------------------------------------------------------------------------------------
+IWLS_MESSAGE_MAX_BYTES = 65536
+IWLS_MESSAGE_MAX_ROWS = 1440
+
+def pack_message_lines(header, datalines, max_bytes=IWLS_MESSAGE_MAX_BYTES, max_rows=IWLS_MESSAGE_MAX_ROWS):
+    """
+    Pack data lines into as few messages as possible, each message bounded by
+    max_bytes and max_rows. Every message gets its own header and CRC.
+
+    params:
+        header = header from get_message_header
+        datalines = list of data lines
+        max_bytes = maximum size of a single message in bytes (None for no limit)
+        max_rows = maximum number of data lines in a single message (None for no limit)
+    return:
+        list of messages
+    """
+    # Fixed size of each message - wrapper, header and checksum 
+    # i.e. ["$ + header + *XXXX"]\r\n
+    overhead = len(('["$' + header + '*0000"]\r\n').encode('utf-8'))
+
+    messages = []
+    current = []
+    current_bytes = overhead
+    for line in datalines:
+        # Lines are separated by a ';' 
+        line_bytes = len(line.encode('utf-8')) + (1 if current else 0)
+
+        too_big = max_bytes is not None and current_bytes + line_bytes > max_bytes
+        too_long = max_rows is not None and len(current) >= max_rows
+        if current and (too_big or too_long):
+            messages.append(build_message(header, current))
+            current = []
+            current_bytes = overhead
+            line_bytes = len(line.encode('utf-8'))
+
+        if max_bytes is not None and overhead + line_bytes > max_bytes:
+            # A single line will not fit - send it on its own anyways 
+            logging.info(f'{header} Data line larger than {max_bytes} bytes: {line[:30]}')
+
+        current.append(line)
+        current_bytes += line_bytes
+
+    if current:
+        messages.append(build_message(header, current))
+
+    return messages
+
+def pack_messages(stationid, listsensors, iwlssensors, gap_data, regionheader,
+                  max_bytes=IWLS_MESSAGE_MAX_BYTES, max_rows=IWLS_MESSAGE_MAX_ROWS):
+    """
+    Same as create_message, but the full gap dataframe is split into messages
+    bounded by max_bytes and max_rows
+
+    params:
+        stationid = five digit station code
+        listsensors = list of sutron sensor names
+        iwlssensors = list of IWLS sensor names in the same order
+        gap_data = dataframe from gap_data_formatter
+        regionheader = name of the region ex: "CTRAR","ATLAN","PACIF","QUE"
+        max_bytes = maximum size of a single message in bytes (None for no limit)
+        max_rows = maximum number of data lines in a single message (None for no limit)
+    return:
+        list of messages (empty list if there is no data)
+    """
+    if gap_data is None or gap_data.empty:
+        return []
+
+    header, list_columns = get_message_header(stationid, listsensors, iwlssensors, gap_data, regionheader)
+    datalines = get_message_datalines(gap_data, list_columns)
+    return pack_message_lines(header, datalines, max_bytes, max_rows)
+
+def merge_messages(messages, max_bytes=IWLS_MESSAGE_MAX_BYTES, max_rows=IWLS_MESSAGE_MAX_ROWS):
+    """
+    Merge small messages (i.e. one per gap) into fewer messages. Only messages 
+    with an identical header (same region, station and sensors) are merged.
+    Duplicate data lines are removed and the merged messages are re-packed 
+    with pack_message_lines so they stay within max_bytes and max_rows.
+
+    params:
+        messages = list of messages from create_message or pack_messages
+        max_bytes = maximum size of a single message in bytes (None for no limit)
+        max_rows = maximum number of data lines in a single message (None for no limit)
+    return:
+        list of messages
+    """
+    # Keep the order the headers were first seen  
+    dict_lines = {}
+    list_unparsed = []
+    for message in messages:
+        header, datalines = split_message(message)
+        if header is None:
+            # Not one of ours - pass it along untouched 
+            list_unparsed.append(message)
+            continue
+
+        lines = dict_lines.setdefault(header, {})
+        for line in datalines:
+            # dict used as an ordered set 
+            lines[line] = None
+
+    merged = []
+    for header, lines in dict_lines.items():
+        merged.extend(pack_message_lines(header, list(lines), max_bytes, max_rows))
+
+    return merged + list_unparsed
 
 # ---------------------------------------------------------------------------------------
 # Added by Mike - 2023-11-22 
@@ -1619,8 +2405,11 @@ def get_timeseries_codes_for_station(station_code):
     param:
         station_code = five digit station identifier (string)
     """    
-    metadata = get_station_metadata(station_code)
-    timeseries_codes = [t['code'] for t in metadata['timeSeries']]
+    # From the time series directory - no need for the whole metadata 
+    station_id = get_station_id_cached(station_code)
+    if station_id is None:
+        return None
+    timeseries_codes = list(get_station_timeseries_ids(station_id))
     return timeseries_codes
 
 # ---------------------------------------------------------------------------------------
@@ -1754,6 +2543,222 @@ def update_station_keys(station_code: str, key_values: dict, iwls_environment: s
     response_content = str(r.content)               
     return status_code, response_content
 
+##--------------------------------------------------------------------------------
+# Bulk key value sync 
+# The current key values are fetched in bulk (get_additional_configurations), only 
+# what is different is sent, and everything goes through one authenticated session 
+# ---------------------------------------------------------------------------------------
+# key / value pairs used to get the current key values of all the stations in bulk 
+# (both casings are in use - see get_station_keys)
+KEY_VALUE_SELECT = [('ip_enabled', 'True'), ('ip_enabled', 'False'), ('ip_enabled', 'true'), ('ip_enabled', 'false')]
+
+def get_station_keys_many(station_codes: list, iwls_environment: str, select=None, session=None,
+                          max_workers=8) ->dict:
+    """
+    Key value pairs for many stations 
+    params:
+        station_codes = list of station codes i.e. ['07120','08615']
+        iwls_environment: one of "dev","test","prod"
+        select = list of (key, value) used to get the key values in bulk (default KEY_VALUE_SELECT)
+                 stations not found this way come from one unfiltered bulk call 
+        session = (authenticated session, base url) from get_session_auth - made if None
+        max_workers = stations asked for at the same time (only if the unfiltered call fails)
+    return:
+        dict of station code: (station id, dict of key values)
+        station id is None if the station is not known 
+    """
+    session, base_url = session or get_session_auth(iwls_environment)
+    wanted = set(station_codes)
+
+    current = {}
+    def add_bulk(params):
+        # True if the bulk call gave a list 
+        r = session.get(url=base_url + '/rest/stations/additional-configurations/', params=params)
+        data_json = r.json()
+        if type(data_json) != list:
+            return False
+        for d in data_json:
+            if d['stationCode'] in wanted and d['stationCode'] not in current:
+                current[d['stationCode']] = (d['stationId'], d['additionalConfigurations'] or {})
+        return True
+
+    for key, value in (select or KEY_VALUE_SELECT):
+        add_bulk({'key': key, 'value': value})
+
+    # 2026-10-19 The rest (i.e. GOES only stations, no ip_enabled) from one call without 
+    # key / value instead of one call per station - a known station not in the reply has no key values 
+    missing = [station_code for station_code in dict.fromkeys(station_codes) if station_code not in current]
+    station_regions = get_station_region_map()
+    if missing and add_bulk({}):
+        for station_code in missing:
+            if station_code not in current:
+                station = station_regions.get(station_code)
+                current[station_code] = (None if station is None else station['id'], {})
+        return current
+
+    # The unfiltered call failed - the rest one by one 
+    def get_keys(station_code):
+        station = station_regions.get(station_code)
+        if station is None:
+            return station_code, (None, {})
+        r = session.get(url=f'{base_url}/rest/stations/{station["id"]}/additional-configurations/')
+        data_json = r.json()
+        return station_code, (station['id'], data_json if isinstance(data_json, dict) else {})
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            current.update(dict(executor.map(get_keys, missing)))
+    return current
+
+def get_key_value_diff(current: dict, desired: dict):
+    """
+    helper function to sync_station_keys 
+    params:
+        current = dict of key values in IWLS 
+        desired = dict of key values wanted - None to delete the key, other keys are not touched
+    return:
+        dict of keys to PATCH, list of keys to DELETE
+    """
+    patch = {}
+    delete = []
+    for key, value in desired.items():
+        if value is None:
+            if key in current:
+                delete.append(key)
+            continue
+        # Key values are strings in IWLS i.e. True -> 'True'
+        value = str(value)
+        if current.get(key) != value:
+            patch[key] = value
+    return patch, delete
+
+def sync_station_keys(desired: dict, iwls_environment: str, dry_run=True, max_workers=8, select=None) ->pd.DataFrame:
+    """
+    Bring the key values of many stations to a desired state with the fewest changes 
+
+    params:
+        desired = dict of station code: dict of key values, a value of None deletes the key
+        {'07120': {'ip_enabled': 'True', 'port': '8081', 'user_login': None},
+         '08615': {'ip_enabled': 'False'}}
+        iwls_environment: one of "dev","test","prod"
+        dry_run = only report what would change (default) - False to apply 
+        max_workers = stations changed at the same time 
+        select = see get_station_keys_many
+    return:
+        Pandas dataframe, one row per station and action with columns
+        code, station_id, action (PATCH, DELETE, NONE, NOT FOUND), changes, status_code, response_content
+        changes is a dict of key: (old value, new value)
+    """
+    session = get_session_auth(iwls_environment)
+    mount_connection_pool(session[0], max_workers)
+    current = get_station_keys_many(list(desired), iwls_environment, select, session, max_workers)
+
+    # Work out what has to change 
+    actions = []
+    for station_code, key_values in desired.items():
+        station_id, current_keys = current.get(station_code, (None, {}))
+        if station_id is None:
+            actions.append((station_code, None, 'NOT FOUND', {}, None))
+            continue
+        patch, delete = get_key_value_diff(current_keys, key_values)
+        if patch:
+            changes = {key: (current_keys.get(key), value) for key, value in patch.items()}
+            actions.append((station_code, station_id, 'PATCH', changes, patch))
+        if delete:
+            changes = {key: (current_keys.get(key), None) for key in delete}
+            actions.append((station_code, station_id, 'DELETE', changes, delete))
+        if not patch and not delete:
+            actions.append((station_code, station_id, 'NONE', {}, None))
+
+    def apply(action):
+        station_code, station_id, name, changes, payload = action
+        row = {'code': station_code, 'station_id': station_id, 'action': name, 'changes': changes,
+               'status_code': None, 'response_content': None}
+        if dry_run or payload is None:
+            return row
+
+        url = f'{session[1]}/rest/stations/{station_id}/additional-configurations/'
+        try:
+            if name == 'PATCH':
+                r = session[0].patch(url=url, data=json.dumps(payload), headers={'Content-Type':'application/json'})
+            else:
+                r = session[0].delete(url=url, data=json.dumps(payload), headers={'Content-Type':'application/json'})
+            row['status_code'] = str(r.status_code)
+            row['response_content'] = str(r.content)
+        except Exception as e:
+            row['response_content'] = str(e)
+        logging.info(f'Key values {station_code} {name} {changes}: {row["status_code"]}')
+        return row
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rows = list(executor.map(apply, actions))
+    return pd.DataFrame(rows, columns=['code','station_id','action','changes','status_code','response_content'])
+
+def get_key_values_table(iwls_environment: str, station_codes=None, select=None, max_workers=8) ->pd.DataFrame:
+    """
+    Key value pairs of the stations of an environment as a long table 
+    params:
+        iwls_environment: one of "dev","test","prod"
+        station_codes = stations to get (None for all the stations in get_station_region_map)
+        select, max_workers = see get_station_keys_many - most stations come in bulk, 
+                              the rest (i.e. GOES only stations, no ip_enabled) from one unfiltered call 
+    return:
+        Pandas dataframe with columns code, station_id, key, value
+    """
+    if station_codes is None:
+        station_codes = list(get_station_region_map())
+    current = get_station_keys_many(station_codes, iwls_environment, select, get_session_auth(iwls_environment),
+                                    max_workers)
+
+    rows = [(station_code, station_id, key, value)
+            for station_code, (station_id, key_values) in current.items()
+            for key, value in key_values.items()]
+    return pd.DataFrame(rows, columns=['code','station_id','key','value'])
+
+def audit_key_values(environments=('dev','test','prod'), station_codes=None, select=None,
+                     only_differences=True, max_workers=8) ->pd.DataFrame:
+    """
+    Compare the key values of the stations between environments 
+    The environments are read at the same time, then compared in one go 
+
+    params:
+        environments = environments to compare 
+        station_codes, select = see get_key_values_table
+        only_differences = only return the keys that are missing or different somewhere
+    return:
+        Pandas dataframe with columns code, key, one column per environment and status
+        status is MISSING (not in all environments), DIFFERENT or SAME 
+        i.e.
+            code   key          dev      test     prod     status
+            07120  port         8081     8081     8082     DIFFERENT
+            07120  user_login   None     u        NaN      MISSING
+    """
+    with ThreadPoolExecutor(max_workers=len(environments)) as executor:
+        tables = list(executor.map(lambda env: get_key_values_table(env, station_codes, select, max_workers),
+                                   environments))
+
+    df = pd.concat([table.assign(environment=env) for env, table in zip(environments, tables)],
+                   ignore_index=True)
+    if df.empty:
+        return pd.DataFrame(columns=['code','key'] + list(environments) + ['status'])
+
+    # A key set to null in IWLS is still there - keep it apart from a missing key 
+    df['value'] = df['value'].where(df['value'].notna(), 'None')
+    df = df.pivot(index=['code','key'], columns='environment', values='value')
+    df = df.reindex(columns=list(environments))
+
+    missing = df.isna().any(axis=1)
+    different = df.nunique(axis=1) > 1
+    df['status'] = 'SAME'
+    df.loc[different, 'status'] = 'DIFFERENT'
+    df.loc[missing, 'status'] = 'MISSING'
+    if only_differences:
+        df = df[df['status'] != 'SAME']
+
+    df = df.reset_index()
+    df.columns.name = None
+    return df
+
 def get_session_auth(iwls_environment: str):
     """
     Get a session object that is authenticated and the start of the url 
@@ -1840,13 +2845,93 @@ def get_modem(station_code: str, iwls_environment: str) ->dict:
             }
         ]
     """
-    # Sample URL 
-    station_id = get_station_id(station_code)
+    # 2026-10-19 From the modem directory - modems are fetched for many stations 
+    # per request and kept (see get_modems_many)
+    station_id = get_station_id_cached(station_code)
+    if station_id is None:
+        station_id = get_station_id(station_code)
+    if station_id is None:
+        return []
+    modems = get_modems_many([station_id], iwls_environment)
+    if station_id in modems:
+        return modems[station_id]
+
+    # The directory did not get it (error reply) - return the reply as it is
     session, base_url = get_session_auth(iwls_environment)
     url = f'{base_url}/rest/modems/?station-ids={station_id}&getAvailableOnly=false'
     r = session.get(url=url)
     data_json = r.json()
-    return data_json    
+    return data_json
+
+##--------------------------------------------------------------------------------
+# Modem directory - iwls_environment: {station id: (time fetched, list of modems)}
+# The modems endpoint takes many station-ids, so they are fetched batch_size 
+# stations per request and kept for MODEM_DIRECTORY_TTL seconds 
+MODEM_DIRECTORY_TTL = 3600
+modem_directory = {}
+modem_directory_lock = threading.Lock()
+
+def get_modems_many(station_ids=None, iwls_environment='prod', region=None, batch_size=50,
+                    max_age_seconds=MODEM_DIRECTORY_TTL) ->dict:
+    """
+    Modems for many stations, batch_size stations per request 
+    params:
+        station_ids = list of station ids (None for all the stations, or the stations of region)
+        iwls_environment: one of "dev","test","prod"    
+        region = region code (ATL,CNA,PAC,QUE) used when station_ids is None
+        batch_size = number of stations per request 
+        max_age_seconds = use the cached modems if not older than this (0 to fetch again)
+    return:
+        dict of station id: list of modem dicts (see get_modem), [] if the station has none
+    """
+    if station_ids is None:
+        station_ids = [station['id'] for station in get_station_region_map().values()
+                       if region is None or station['chsRegionCode'] == region]
+
+    with modem_directory_lock:
+        directory = modem_directory.setdefault(iwls_environment, {})
+        now = time.monotonic()
+        modems = {station_id: directory[station_id][1] for station_id in station_ids
+                  if station_id in directory and now - directory[station_id][0] <= max_age_seconds}
+    missing = [station_id for station_id in dict.fromkeys(station_ids) if station_id not in modems]
+    if not missing:
+        return modems
+
+    # One session for all the batches 
+    session, base_url = get_session_auth(iwls_environment)
+    for i in range(0, len(missing), batch_size):
+        batch = missing[i:i + batch_size]
+        url = f'{base_url}/rest/modems/?station-ids={",".join(batch)}&getAvailableOnly=false'
+        r = session.get(url=url)
+        data_json = r.json()
+        if type(data_json) != list:
+            # Probably an error - do not keep it 
+            logging.info(f'Modem directory: {data_json}')
+            continue
+
+        found = {station_id: [] for station_id in batch}
+        for modem in data_json:
+            found.setdefault(modem.get('stationId'), []).append(modem)
+
+        with modem_directory_lock:
+            for station_id, list_modems in found.items():
+                directory[station_id] = (time.monotonic(), list_modems)
+        modems.update({station_id: found[station_id] for station_id in batch})
+    return modems
+
+def get_modem_table(station_ids=None, iwls_environment='prod', region=None) ->pd.DataFrame:
+    """
+    Modems for many stations as a table i.e. for the ip address and phone number of a region 
+    return:
+        Pandas dataframe with columns code, station_id and the modem fields 
+        (ipAddress, phoneNumber ...), one row per modem
+    """
+    codes = {station['id']: code for code, station in get_station_region_map().items()}
+    rows = []
+    for station_id, list_modems in get_modems_many(station_ids, iwls_environment, region).items():
+        for modem in list_modems:
+            rows.append({'code': codes.get(station_id), 'station_id': station_id, **modem})
+    return pd.DataFrame(rows)
 
 # ---------------------------------------------------------------------------------------
 # Added by Mike - 2024-05-15
@@ -1962,48 +3047,24 @@ def get_all_metadata(station_code: str) ->StationMetaData:
     # Append the dictionaries 
     metadata.update(key_value)
 
-    # Create our complete metadata object which includes 
-    # the IWLS metadata and all of our custom keys
-    station_metadata = StationMetaData()
-    for key,value in metadata.items(): 
-        setattr(station_metadata, key, value)   
-
     # 2025-02-06
     # Some keys are different between public and private so lets add 
     # what keys that we can     
-    station_metadata.officialName = station_metadata.name
-    station_metadata.operating = station_metadata.active
+    metadata['officialName'] = metadata.get('name', '')
+    metadata['operating'] = metadata.get('active', '')
 
     # Using the private api's generate no region code thus we need to look it up 
-    chsRegionCode = get_region_private(station_code)
-    station_metadata.chsRegionCode = chsRegionCode
-
-    # Change multivalue strings into a list 
-    s = station_metadata.iwls_sensors.split(',')
-    setattr(station_metadata,'iwls_sensors',s)
-    s = station_metadata.sutron_sensors.split(',')
-    setattr(station_metadata,'sutron_sensors',s)   
-    s = station_metadata.goes_iwls_sensors.split(',')
-    setattr(station_metadata,'goes_iwls_sensors',s)
-    s = station_metadata.goes_sutron_sensors.split(',')
-    setattr(station_metadata,'goes_sutron_sensors',s)       
+    metadata['chsRegionCode'] = get_station_region(station_code)
 
-    # Change True / False entries in boolean
-    b = string_to_bool(station_metadata.ip_enabled)
-    setattr(station_metadata,'ip_enabled',b)
-    b = string_to_bool(station_metadata.modem_enabled)
-    setattr(station_metadata,'modem_enabled',b)       
-    b = string_to_bool(station_metadata.goes_enabled)
-    setattr(station_metadata,'goes_enabled',b)   
+    # Create our complete metadata object which includes 
+    # the IWLS metadata and all of our custom keys
+    # Multivalue strings are changed into lists and True / False entries into booleans
+    station_metadata = StationMetaData.from_dict(metadata)
 
     # Now add any calculated keys 
     region_header = get_region_header(station_metadata.chsRegionCode)
     setattr(station_metadata, 'region_header', region_header)   
 
-    # NOTE: special case - backwards compatibility  
-    setattr(station_metadata, 'xconnectlogfile', station_metadata.log_name)       
-    setattr(station_metadata, 'ip', station_metadata.ip_address)   
-
     return station_metadata
 
 def get_all_metadata_for_key_value(key: str, value: str, iwls_environment: str, region=None) ->list:
@@ -2101,25 +3162,25 @@ def get_all_metadata_for_key_value(key: str, value: str, iwls_environment: str,
         {
     '''
 
+    # 2026-10-19 Index the stations by code once instead of searching the lists for each station 
+    station_regions = get_station_region_map()
+
     # Loop thru the list of key values 
     list_metadata = []
     for d in list_kv:
         station_code = d['stationCode']        
         kv = d['additionalConfigurations']
 
-        # Get the station info 
-        station = next((item for item in list_stations if item["code"] == station_code), None)
+        # Get the station info and region code from the station region map 
+        station = station_regions.get(station_code) or get_station_region_map_lookup(station_code)
         if station is None:
             continue 
 
-        # Get the region code         
         chsRegionId = station['chsRegionId']
-        dict_region = next((item for item in list_regions if item["id"] == chsRegionId), None)
-        if dict_region is None:
+        chsRegionCode = station['chsRegionCode']
+        if chsRegionCode is None:
             continue
 
-        chsRegionCode = dict_region['code']
-
         # Test if we filter on region 
         if region is not None:
             if chsRegionCode != region:
@@ -2226,7 +3287,7 @@ def get_all_metadata_station(station_code: str) ->dict:
     m['operating'] = m['active']
 
     # Using the private api's generate no region code thus we need to look it up 
-    chsRegionCode = get_region_private(station_code)
+    chsRegionCode = get_station_region(station_code)
     m['chsRegionCode'] = chsRegionCode
 
     # Change multivalue strings into a list 
@@ -2277,6 +3338,87 @@ def get_region_list():
     data_json = r.json()
     return data_json
 
+##--------------------------------------------------------------------------------
+# Station region map - station code: id, name, chsRegionId, chsRegionCode, region_header
+# Built from the two bulk calls (list_stations and list_regions) so the region of a 
+# station needs no call of its own. Built again when list_stations is reset or 
+# older than STATION_LIST_TTL seconds (new stations are added to IWLS)
+STATION_LIST_TTL = 3600
+# An unknown station code gets the lists again at most once per STATION_LIST_MISS_INTERVAL seconds
+STATION_LIST_MISS_INTERVAL = 60
+station_region_map = {'source': None, 'loaded': None, 'miss_refresh': None, 'map': {}}
+station_region_map_lock = threading.Lock()
+
+def get_station_region_map(refresh=False) ->dict:
+    """
+    Region of every station from the private station list and the region list, 
+    the lists are fetched again when older than STATION_LIST_TTL
+    params:
+        refresh = get the station and region lists again 
+    return:
+        dict of station code: dict i.e. 
+        {'07120': {'id': '5cebf1df3d0f4a073c4bbd1e', 'name': 'Victoria Harbour', 
+                   'chsRegionId': '5ce598e3487b844868928221', 'chsRegionCode': 'PAC', 
+                   'region_header': 'PACIF'}, ...}
+    """
+    global list_stations
+    global list_regions
+
+    with station_region_map_lock:
+        loaded = station_region_map['loaded']
+        if refresh or (loaded is not None and time.monotonic() - loaded > STATION_LIST_TTL):
+            list_stations = []
+            list_regions = []
+        if not list_stations:
+            list_stations = get_stations_list_private()
+        if not list_regions:
+            list_regions = get_region_list()
+
+        if station_region_map['source'] is list_stations:
+            return station_region_map['map']
+
+        region_codes = {region['id']: region['code'] for region in list_regions}
+        regions = {}
+        for station in list_stations:
+            chsRegionCode = region_codes.get(station.get('chsRegionId'))
+            regions[station['code']] = {'id': station['id'],
+                                        'name': station.get('name'),
+                                        'chsRegionId': station.get('chsRegionId'),
+                                        'chsRegionCode': chsRegionCode,
+                                        'region_header': get_region_header(chsRegionCode)}
+        station_region_map['source'] = list_stations
+        station_region_map['loaded'] = time.monotonic()
+        station_region_map['map'] = regions
+        return regions
+
+def get_station_region_map_on_miss() ->dict:
+    # helper function to get_station_region_map_lookup
+    # A code we do not know may be a new station - get the lists again, but not for 
+    # every lookup of a code that does not exist 
+    with station_region_map_lock:
+        last = station_region_map['miss_refresh']
+        if last is not None and time.monotonic() - last < STATION_LIST_MISS_INTERVAL:
+            return station_region_map['map']
+        station_region_map['miss_refresh'] = time.monotonic()
+    return get_station_region_map(refresh=True)
+
+def get_station_region_map_lookup(station_code: str):
+    # helper function to get_station_id_cached / get_station_region
+    station = get_station_region_map().get(station_code)
+    if station is None:
+        station = get_station_region_map_on_miss().get(station_code)
+    return station
+
+def get_station_region(station_code: str) ->str:
+    """
+    Region code of a station i.e. '07120' returns 'PAC' - from the station region map, 
+    get_region_private is only called for a station that is not in the map 
+    """
+    station = get_station_region_map_lookup(station_code)
+    if station is None or station['chsRegionCode'] is None:
+        return get_region_private(station_code)
+    return station['chsRegionCode']
+
 def get_region_header(chsRegionCode: str) ->str:
     region_map =  {'PAC':'PACIF','CNA':'CTRAR','QUE':'QUE','ATL':'ATLAN'}
     try:
@@ -2457,10 +3599,89 @@ def get_logbook_entries(station_code, iwls_environment):
 
     # TEMPORARY SOLUTION - USE BEARER TOKEN AS SWAGGER API 
     token = "hidden"
-    station_id = get_station_id_private(station_code)
+    station_id = get_station_id_cached(station_code)
     session, base_url = get_session_auth(iwls_environment)
     session.headers.update({'Authorization': "Bearer " + token})
     url = f'{private_base_url}stations/{station_id}/logbook'
     r = session.get(url=url)
     data_json = r.json()
-    return data_json
\ No newline at end of file
+    return data_json
+
+def get_logbook_pages(session, url, params=None, page_size=500):
+    """
+    Pages of logbook entries from a logbook url, so a large logbook is asked for 
+    page_size entries at a time instead of in one large response 
+    params:
+        session = authenticated session (get_session_auth)
+        url = logbook url of a station
+        params = extra query parameters i.e. {'from': '2026-10-01T00:00:00Z'}
+        page_size = entries asked for per page
+    return:
+        generator of lists of logbook entries (json)
+        If the endpoint does not page (returns a list) there is one page 
+    """
+    page = 0
+    while True:
+        r = session.get(url=url, params={**(params or {}), 'page': page, 'size': page_size})
+        r.raise_for_status()
+        data_json = r.json()
+        if type(data_json) == list:
+            yield data_json
+            return
+        # Pageable response {'content': [...], 'last': bool, ...}
+        entries = data_json.get('content') or []
+        yield entries
+        if data_json.get('last', True) or not entries:
+            return
+        page += 1
+
+def get_logbook_entry_date(entry):
+    """
+    return:
+        date of a logbook entry as a string yyyy-mm-ddThh:mm:ssZ, None if it has none
+    """
+    for field in ('eventDate', 'date', 'creationDate', 'createdDate'):
+        if entry.get(field):
+            return entry[field]
+    return None
+
+def get_logbook_entries_many(station_codes, iwls_environment, since=None, page_size=500, max_workers=8):
+    """
+    Get the logbook entries of many stations at the same time, on one authenticated session
+    params:
+        station_codes = list of station codes
+        iwls_environment: one of "dev","test","prod"
+        since = {station_code: date} only get the entries from the date on (newest entry already kept, 
+                entries with the same date are asked for again)
+        page_size, max_workers = entries per page and stations fetched at the same time 
+    return:
+        dict {station_code: list of logbook entries (json)}, None for a station that failed
+    """
+    since = since or {}
+    # TEMPORARY SOLUTION - USE BEARER TOKEN AS SWAGGER API 
+    token = "hidden"
+    session, base_url = get_session_auth(iwls_environment)
+    session.headers.update({'Authorization': "Bearer " + token})
+    mount_connection_pool(session, max_workers)
+    station_ids = {station_code: get_station_id_cached(station_code) for station_code in station_codes}
+
+    def get_entries(station_code):
+        station_id = station_ids[station_code]
+        if station_id is None:
+            logging.info(f'Logbook {station_code}: station not found')
+            return station_code, None
+        params = {'from': since[station_code]} if since.get(station_code) else None
+        try:
+            entries = [entry for page in get_logbook_pages(session, f'{private_base_url}stations/{station_id}/logbook',
+                                                           params, page_size) for entry in page]
+        except Exception as e:
+            logging.info(f'Logbook {station_code}: {e}')
+            return station_code, None
+        if params:
+            # In case the endpoint ignores from - an entry with no date is kept (the caller keys it by id)
+            entries = [entry for entry in entries
+                       if get_logbook_entry_date(entry) is None or get_logbook_entry_date(entry) >= since[station_code]]
+        return station_code, entries
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(get_entries, station_codes))
\ No newline at end of file
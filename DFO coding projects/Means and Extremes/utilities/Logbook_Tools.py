@@ -0,0 +1,248 @@
+"""Logbook_Tools
+
+DFO-MPO/CHS-SHC
+Institute of Ocean Sciences / Institut des sciences de la mer
+
+Local copy of the IWLS station logbooks. The entries are kept in a SQLite
+database indexed by station, category and date so the QC / gap questions
+(what happened at these stations between these dates) are answered from disk.
+Each refresh only asks IWLS for the entries from the newest one kept on.
+
+Run from the project folder to refresh the logbooks of all the stations of a region:
+    python -m utilities.Logbook_Tools --environment prod --region PAC
+and to look at what is kept:
+    python -m utilities.Logbook_Tools --no-refresh --stations 07120 08615 --start 2026-10-01 --category "Field Visit"
+
+This file can be imported as a module and contains the following
+classes and functions:
+
+    * LogbookIndex - SQLite index of the logbook entries by station, category and date
+    * refresh_logbooks - gets the new logbook entries of many stations at the same time and keeps them
+
+"""
+
+# Standard imports
+import argparse
+import pandas as pd
+from datetime import datetime
+import json
+import logging
+import sqlite3
+import threading
+
+from . import IWLS_API_Tools as api
+
+##--------------------------------------------------------------------------------
+class LogbookIndex:
+    """
+    SQLite index of the logbook entries by station, category and date
+
+    Usage:
+        index = LogbookIndex('logbook.db')
+        refresh_logbooks(index, ['07120', '08615'], 'prod')
+        df = index.query(start='2026-10-01', categories=['Field Visit'])
+    """
+
+    def __init__(self, db_file='logbook.db'):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS logbook_entries (
+                entry_id TEXT PRIMARY KEY,
+                station_code TEXT NOT NULL,
+                station_id TEXT,
+                category_id TEXT,
+                date TEXT,
+                entry TEXT NOT NULL,
+                fetched TEXT NOT NULL
+            )""")
+        self.conn.execute('CREATE INDEX IF NOT EXISTS logbook_station_date ON logbook_entries (station_code, date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS logbook_category_date ON logbook_entries (category_id, date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS logbook_date ON logbook_entries (date)')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS logbook_categories (
+                category_id TEXT PRIMARY KEY,
+                name_en TEXT,
+                name_fr TEXT
+            )""")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def put_categories(self, categories):
+        """
+        params:
+            categories = json from api.get_logbook_categories
+        """
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO logbook_categories (category_id, name_en, name_fr) '
+                                  'VALUES (?, ?, ?)',
+                                  [(c['id'], c.get('nameEn'), c.get('nameFr')) for c in categories])
+            self.conn.commit()
+
+    def get_categories(self):
+        """
+        return:
+            dict {category_id: name_en}
+        """
+        with self.lock:
+            return dict(self.conn.execute('SELECT category_id, name_en FROM logbook_categories').fetchall())
+
+    def put_entries(self, station_code, entries, station_id=None):
+        """
+        Keep the logbook entries of a station, an entry already kept is replaced 
+        (by id, so an entry with no date is kept once with a date of None)
+        params:
+            entries = list of logbook entries (json) from api.get_logbook_entries_many
+        return:
+            number of entries given (some may have been kept already)
+        """
+        now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        rows = []
+        for entry in entries:
+            # No id - the entry itself is the key
+            entry_id = entry.get('id') or f"{station_code}/{json.dumps(entry, sort_keys=True)}"
+            category_id = entry.get('categoryId') or (entry.get('category') or {}).get('id')
+            rows.append((entry_id, station_code, station_id or entry.get('stationId'), category_id,
+                         api.get_logbook_entry_date(entry), json.dumps(entry), now))
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO logbook_entries (entry_id, station_code, station_id, '
+                                  'category_id, date, entry, fetched) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+        return len(rows)
+
+    def get_newest(self, station_codes=None):
+        """
+        return:
+            dict {station_code: date of the newest entry kept}
+        """
+        sql = 'SELECT station_code, MAX(date) FROM logbook_entries'
+        params = []
+        if station_codes is not None:
+            sql += f" WHERE station_code IN ({','.join('?' * len(station_codes))})"
+            params = list(station_codes)
+        with self.lock:
+            return dict(self.conn.execute(sql + ' GROUP BY station_code', params).fetchall())
+
+    def count(self, station_code=None):
+        """
+        return:
+            number of entries kept (for a station, or all)
+        """
+        sql = 'SELECT COUNT(*) FROM logbook_entries'
+        params = []
+        if station_code is not None:
+            sql += ' WHERE station_code = ?'
+            params.append(station_code)
+        with self.lock:
+            return self.conn.execute(sql, params).fetchone()[0]
+
+    def query(self, station_codes=None, categories=None, start=None, end=None, text=None):
+        """
+        Logbook entries kept, across stations
+        params:
+            station_codes = list of station codes (None for all)
+            categories = list of category names i.e. ['Field Visit'] (None for all)
+            start, end = dates yyyy-mm-dd or yyyy-mm-ddThh:mm:ssZ, start included and end excluded
+                         (entries with no date are only returned when neither is given)
+            text = only the entries containing the text
+        return:
+            Pandas dataframe with columns station_code, date, category, entry (dict) sorted by date
+        """
+        # Category names come from the categories known now, not when the entry was kept 
+        sql = ('SELECT e.station_code, e.date, c.name_en, e.entry FROM logbook_entries e '
+               'LEFT JOIN logbook_categories c ON c.category_id = e.category_id WHERE 1 = 1')
+        params = []
+        if station_codes is not None:
+            sql += f" AND e.station_code IN ({','.join('?' * len(station_codes))})"
+            params += list(station_codes)
+        if categories is not None:
+            sql += f" AND c.name_en IN ({','.join('?' * len(categories))})"
+            params += list(categories)
+        if start is not None:
+            sql += ' AND e.date >= ?'
+            params.append(start)
+        if end is not None:
+            sql += ' AND e.date < ?'
+            params.append(end)
+        if text is not None:
+            sql += ' AND e.entry LIKE ?'
+            params.append(f'%{text}%')
+        with self.lock:
+            rows = self.conn.execute(sql + ' ORDER BY e.date, e.station_code', params).fetchall()
+        return pd.DataFrame([(code, date, category, json.loads(entry)) for code, date, category, entry in rows],
+                            columns=['station_code', 'date', 'category', 'entry'])
+
+##--------------------------------------------------------------------------------
+def refresh_logbooks(index, station_codes, iwls_environment, full=False, page_size=500, max_workers=8):
+    """
+    Get the new logbook entries of many stations at the same time and keep them in the index
+    params:
+        index = LogbookIndex
+        station_codes = list of station codes
+        iwls_environment: one of "dev","test","prod"
+        full = get all the entries again instead of the ones from the newest kept on 
+               (entries with the newest date are asked for again - the entry id keeps them once)
+        page_size, max_workers = see api.get_logbook_entries_many
+    return:
+        Pandas dataframe with columns station_code, new_entries, newest, status
+        new_entries counts the entries kept by this refresh that were not kept before
+    """
+    try:
+        index.put_categories(api.get_logbook_categories())
+    except Exception as e:
+        # Keep the categories already known
+        logging.info(f'Logbook categories: {e}')
+
+    since = {} if full else index.get_newest(station_codes)
+    entries = api.get_logbook_entries_many(station_codes, iwls_environment, since, page_size, max_workers)
+
+    rows = []
+    for station_code in station_codes:
+        if entries.get(station_code) is None:
+            rows.append((station_code, 0, since.get(station_code), 'Failed'))
+            continue
+        before = index.count(station_code)
+        index.put_entries(station_code, entries[station_code], api.get_station_id_cached(station_code))
+        rows.append((station_code, index.count(station_code) - before, None, 'OK'))
+    newest = index.get_newest(station_codes)
+    df = pd.DataFrame(rows, columns=['station_code', 'new_entries', 'newest', 'status'])
+    df['newest'] = df['station_code'].map(newest)
+    return df
+
+##--------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Keep a local copy of the IWLS station logbooks')
+    parser.add_argument('--environment', default='prod', help='one of dev, test, prod')
+    parser.add_argument('--region', default=None, help='one of ATL, CNA, PAC, QUE (default all)')
+    parser.add_argument('--stations', nargs='*', default=None, help='station codes (default all of the region)')
+    parser.add_argument('--db', default='logbook.db', help='logbook database')
+    parser.add_argument('--full', action='store_true', help='get all the entries again')
+    parser.add_argument('--no-refresh', action='store_true', help='only query what is kept')
+    parser.add_argument('--category', nargs='*', default=None, help='category names to show')
+    parser.add_argument('--start', default=None, help='show entries from this date')
+    parser.add_argument('--end', default=None, help='show entries before this date')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    index = LogbookIndex(args.db)
+    station_codes = args.stations
+    if station_codes is None:
+        station_codes = [code for code, station in api.get_station_region_map().items()
+                         if args.region is None or station['chsRegionCode'] == args.region]
+
+    if not args.no_refresh:
+        df = refresh_logbooks(index, station_codes, args.environment, full=args.full)
+        print(df.to_string(index=False))
+
+    if args.stations is not None or args.category is not None or args.start is not None or args.end is not None:
+        df = index.query(args.stations, args.category, args.start, args.end)
+        print(df[['station_code', 'date', 'category']].to_string(index=False))
+    index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2184 @@
+"""GapFill_Tools
+
+DFO-MPO/CHS-SHC
+Institute of Ocean Sciences / Institut des sciences de la mer
+
+Building blocks for the GapFill scripts that sit on top of IWLS_API_Tools.
+Anything here that keeps state between runs uses a local SQLite database
+so a run can be stopped and started again without losing work.
+
+Run from the project folder to fill the gaps for all ip enabled stations:
+    python -m utilities.GapFill_Tools --environment prod --region PAC --hours 72
+and to continue a run that was stopped (crash, reboot):
+    python -m utilities.GapFill_Tools --resume
+
+This file can be imported as a module and contains the following
+classes and functions:
+
+    * MessageOutbox - SQLite outbox, messages are stored before sending and drained with acknowledgement tracking
+    * get_message_span - returns station code, first / last observation time and CRC of a message
+    * get_message_times - returns the observation times in a message
+    * get_station_object - returns a StationMetaData object from a metadata dict
+    * GapFillCheckpoint - SQLite checkpoint of a run so it can be resumed where it stopped
+    * LoggerResponseCache - SQLite cache of the validated logger records per station and query
+    * get_gap_data_from_station_cached - get_gap_data_from_station that only queries the logger for what is not cached
+    * SensorMapCache - SQLite cache of the sensor maps parsed from the .bas files, checked with a DIR listing
+    * StationHealth - health per station and a circuit breaker so dead stations fail fast
+    * get_gap_data_from_station_checked - get_gap_data_from_station that checks / records the station health
+    * QueryPacer - learns the delay between queries and the query size for each station
+    * get_retrieval_units - splits a station with several dataloggers / log files (ip, port, log) into retrieval units
+    * get_logger_key - key for everything kept per logger i.e. 07120/DL2
+    * reconcile_gap_data - drops the logger rows IWLS already has before sending
+    * verify_fill - checks the gaps again after sending and returns the fill ratio
+    * GapFillPipeline - runs the gap fill stages for many stations, each stage with its own workers
+    * GapIndex - SQLite index of gaps between scheduler cycles, failing gaps are backed off exponentially
+    * GapFillScheduler - long running scheduler, fills the stations that recover the most data per minute first
+
+"""
+
+# Standard imports
+import argparse
+import copy
+import pandas as pd
+from datetime import datetime,timedelta
+import json
+import logging
+import queue
+import re
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from . import IWLS_API_Tools as api
+
+##--------------------------------------------------------------------------------
+def get_message_span(message):
+    """
+    Get the station and time span covered by a message
+    params:
+        message = message from create_message / pack_messages
+        i.e. ["$PACIF,07120,WL1,WL2;181212,170300,0.565,m,G,0.567,m,G*8F56"]\r\n
+    return:
+        station_code, start, end (ISO 8601 strings), crc
+        None if the message can not be parsed
+    """
+    header, datalines = api.split_message(message)
+    if header is None:
+        return None
+
+    # Header looks like PACIF,07120,WL1,WL2;
+    station_code = header.split(',')[1].rstrip(';')
+
+    dates = get_message_times(message)
+    if not dates:
+        return None
+
+    crc = message.strip()[:-2].rsplit('*', 1)[-1]
+    start = min(dates).strftime('%Y-%m-%dT%H:%M:%SZ')
+    end = max(dates).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return station_code, start, end, crc
+
+def get_message_times(message):
+    """
+    return:
+        list of the observation times (datetime) in a message, empty if it can not be parsed
+    """
+    header, datalines = api.split_message(message)
+    if header is None:
+        return []
+
+    # Data lines start with the date and time i.e. 181212,170300
+    # NOTE: lines are not always in order - the most recent gap is queried first
+    dates = []
+    for line in datalines:
+        try:
+            dates.append(datetime.strptime(line[:13], '%y%m%d,%H%M%S'))
+        except ValueError:
+            continue
+    return dates
+
+# ---------------------------------------------------------------------------------------
+# Durable outbox for IWLS observation messages
+# Messages are written to the outbox BEFORE they are sent, so if IWLS is down
+# (token error, timeout, outage) the data retrieved from the loggers is not lost
+# ---------------------------------------------------------------------------------------
+class MessageOutbox:
+    """
+    SQLite outbox of messages waiting to be sent to IWLS
+
+    Each message is stored once - duplicates are found on station, time span
+    and CRC. Status of a message is one of:
+        PENDING - waiting to be sent (or waiting for a retry)
+        SENT    - IWLS acknowledged the message (200, 201, 202)
+        FAILED  - retries exhausted, see last_status_code / last_response
+    FAILED messages are put back to PENDING by retry_failed, the scheduler does it 
+    at the start of each cycle up to max_requeues times per message
+
+    Usage:
+        outbox = MessageOutbox('gapfill_outbox.db')
+        outbox.add_messages(messages, 'prod')
+        df = outbox.drain()
+    """
+
+    def __init__(self, db_file='gapfill_outbox.db', max_attempts=5, max_requeues=3):
+        self.db_file = db_file
+        self.max_attempts = max_attempts
+        self.max_requeues = max_requeues
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                station_code TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                crc TEXT NOT NULL,
+                iwls_environment TEXT NOT NULL,
+                message TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'PENDING',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_status_code TEXT,
+                last_response TEXT,
+                created TEXT NOT NULL,
+                acknowledged TEXT,
+                requeued INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (station_code, start, end, crc, iwls_environment)
+            )""")
+        try:
+            # Outbox file from before requeued was kept 
+            self.conn.execute('ALTER TABLE outbox ADD COLUMN requeued INTEGER NOT NULL DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def add_message(self, message, iwls_environment):
+        """
+        Store a message in the outbox
+        params:
+            message = message from create_message / pack_messages
+            iwls_environment = one of "dev","test","prod"
+        return:
+            id of the new row, None if the message is a duplicate or can not be parsed
+        """
+        span = get_message_span(message)
+        if span is None:
+            logging.info(f'Outbox: message could not be parsed: {message[:30]}')
+            return None
+
+        station_code, start, end, crc = span
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO outbox (station_code, start, end, crc, iwls_environment, message, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (station_code, start, end, crc, iwls_environment, message,
+                 datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')))
+            self.conn.commit()
+
+        if cursor.rowcount == 0:
+            logging.info(f'Outbox: duplicate message {station_code} {start} {end} {crc}')
+            return None
+        return cursor.lastrowid
+
+    def add_messages(self, messages, iwls_environment):
+        """
+        Store a list of messages in the outbox
+        return:
+            list of ids of the new rows (duplicates are skipped)
+        """
+        ids = []
+        for message in messages:
+            id = self.add_message(message, iwls_environment)
+            if id is not None:
+                ids.append(id)
+        return ids
+
+    def get_pending(self, iwls_environment=None, station_code=None):
+        """
+        Get the messages waiting to be sent, oldest first
+        return:
+            list of (id, iwls_environment, message)
+        """
+        sql = "SELECT id, iwls_environment, message FROM outbox WHERE status = 'PENDING'"
+        params = []
+        if iwls_environment is not None:
+            sql += ' AND iwls_environment = ?'
+            params.append(iwls_environment)
+        if station_code is not None:
+            sql += ' AND station_code = ?'
+            params.append(station_code)
+        sql += ' ORDER BY id'
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def acknowledge(self, id, status_code, response_content, success):
+        """
+        Record the result of sending a message
+        A failed message goes back to PENDING until max_attempts is reached
+        """
+        now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        with self.lock:
+            if success:
+                self.conn.execute(
+                    "UPDATE outbox SET status = 'SENT', attempts = attempts + 1, last_status_code = ?, "
+                    "last_response = ?, acknowledged = ? WHERE id = ?",
+                    (status_code, response_content, now, id))
+            else:
+                self.conn.execute(
+                    "UPDATE outbox SET attempts = attempts + 1, last_status_code = ?, last_response = ?, "
+                    "status = CASE WHEN attempts + 1 >= ? THEN 'FAILED' ELSE 'PENDING' END WHERE id = ?",
+                    (status_code, response_content, self.max_attempts, id))
+            self.conn.commit()
+
+    def get_message_status(self, message, iwls_environment):
+        """
+        return:
+            status of the message (PENDING, SENT, FAILED), None if it is not in the outbox
+        """
+        span = get_message_span(message)
+        if span is None:
+            return None
+        with self.lock:
+            rows = self.conn.execute('SELECT status FROM outbox WHERE station_code = ? AND start = ? AND end = ? '
+                                     'AND crc = ? AND iwls_environment = ?', (*span, iwls_environment)).fetchall()
+        return rows[0][0] if rows else None
+
+    def retry_failed(self, station_code=None, capped=False):
+        """
+        Put FAILED messages back to PENDING i.e. after an IWLS outage is over
+        params:
+            station_code = only this station (None for all)
+            capped = only the messages put back fewer than max_requeues times (automatic retries) 
+        return:
+            number of messages put back to PENDING
+        """
+        sql = "UPDATE outbox SET status = 'PENDING', attempts = 0, requeued = requeued + 1 WHERE status = 'FAILED'"
+        params = []
+        if station_code is not None:
+            sql += ' AND station_code = ?'
+            params.append(station_code)
+        if capped:
+            sql += ' AND requeued < ?'
+            params.append(self.max_requeues)
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+        return cursor.rowcount
+
+    def drain(self, iwls_environment=None, max_workers=8, retries=3, station_code=None):
+        """
+        Send all pending messages with send_messages_to_IWLS_bulk and record
+        the acknowledgement for each one
+        params:
+            iwls_environment = only drain this environment (None for all)
+            max_workers, retries = see send_messages_to_IWLS_bulk
+            station_code = only drain this station (None for all)
+        return:
+            Pandas dataframe from send_messages_to_IWLS_bulk with an added outbox_id column
+            None if there was nothing to send
+        """
+        pending = self.get_pending(iwls_environment, station_code)
+        if not pending:
+            return None
+
+        # One bulk send per environment
+        list_df = []
+        for env in sorted(set(row[1] for row in pending)):
+            rows = [row for row in pending if row[1] == env]
+            try:
+                df = api.send_messages_to_IWLS_bulk([row[2] for row in rows], env,
+                                                    max_workers=max_workers, retries=retries)
+            except Exception as e:
+                # i.e. could not get a token - messages stay PENDING for the next drain
+                logging.info(f'Outbox: could not send to {env}: {e}')
+                continue
+
+            df['outbox_id'] = [rows[i][0] for i in df['message_index']]
+            for index, row in df.iterrows():
+                self.acknowledge(int(row['outbox_id']), row['status_code'], row['response_content'], bool(row['success']))
+            list_df.append(df)
+
+        if not list_df:
+            return None
+        return pd.concat(list_df, ignore_index=True)
+
+    def get_status(self):
+        """
+        Count of messages per station and status
+        return:
+            Pandas dataframe with columns station_code, iwls_environment, status, count
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT station_code, iwls_environment, status, COUNT(*) FROM outbox '
+                'GROUP BY station_code, iwls_environment, status ORDER BY station_code').fetchall()
+        return pd.DataFrame(rows, columns=['station_code','iwls_environment','status','count'])
+
+# ---------------------------------------------------------------------------------------
+# Checkpoints for resumable gap fill runs 
+# For each run and station we keep the planned queries, the records returned by 
+# the logger for each query, the messages built and which ones IWLS acknowledged.
+# A resumed run only asks the loggers for the queries that were not answered 
+# and only sends the messages that were not acknowledged.
+# ---------------------------------------------------------------------------------------
+class GapFillCheckpoint:
+    """
+    SQLite checkpoint of a gap fill run
+
+    Usage:
+        checkpoint = GapFillCheckpoint('gapfill_state.db')
+        checkpoint.new_run(start_time, end_time, 'prod')      # or checkpoint.resume_run()
+        pipeline = GapFillPipeline(start_time, end_time, 'prod', checkpoint=checkpoint)
+        pipeline.run(stations)
+    """
+
+    def __init__(self, db_file='gapfill_state.db'):
+        self.db_file = db_file
+        self.run_id = None
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                created TEXT NOT NULL,
+                start_time TEXT NOT NULL,
+                end_time TEXT NOT NULL,
+                iwls_environment TEXT,
+                status TEXT NOT NULL DEFAULT 'RUNNING'
+            );
+            CREATE TABLE IF NOT EXISTS run_stations (
+                run_id TEXT NOT NULL,
+                station_code TEXT NOT NULL,
+                stage TEXT,
+                status TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (run_id, station_code)
+            );
+            CREATE TABLE IF NOT EXISTS run_queries (
+                run_id TEXT NOT NULL,
+                station_code TEXT NOT NULL,
+                query TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                records TEXT,
+                PRIMARY KEY (run_id, station_code, query)
+            );
+            CREATE TABLE IF NOT EXISTS run_messages (
+                run_id TEXT NOT NULL,
+                station_code TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                acknowledged INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (run_id, station_code, idx)
+            );
+            """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cursor.fetchall()
+
+    ##--------------------------------------------------------------------------------
+    def new_run(self, start_time, end_time, iwls_environment=None):
+        """
+        Start a new run 
+        return:
+            run id i.e. 20250124T093000.123456-3f9a1c (the random part keeps runs started 
+            at the same time apart)
+        """
+        now = datetime.utcnow()
+        self.run_id = f"{now.strftime('%Y%m%dT%H%M%S.%f')}-{uuid.uuid4().hex[:6]}"
+        self.execute('INSERT INTO runs (run_id, created, start_time, end_time, iwls_environment) VALUES (?, ?, ?, ?, ?)',
+                     (self.run_id, now.strftime('%Y-%m-%dT%H:%M:%SZ'), start_time, end_time, iwls_environment))
+        return self.run_id
+
+    def resume_run(self, run_id=None):
+        """
+        Continue a run - the latest unfinished run if run_id is None
+        return:
+            start_time, end_time, iwls_environment of the run
+            None if there is no run to resume
+        """
+        if run_id is None:
+            rows = self.execute("SELECT run_id, start_time, end_time, iwls_environment FROM runs "
+                                "WHERE status = 'RUNNING' ORDER BY run_id DESC LIMIT 1")
+        else:
+            rows = self.execute('SELECT run_id, start_time, end_time, iwls_environment FROM runs WHERE run_id = ?',
+                                (run_id,))
+        if not rows:
+            return None
+        self.run_id = rows[0][0]
+        logging.info(f'Checkpoint: resuming run {self.run_id}')
+        return rows[0][1], rows[0][2], rows[0][3]
+
+    def complete_run(self):
+        self.execute("UPDATE runs SET status = 'COMPLETE' WHERE run_id = ?", (self.run_id,))
+
+    ##--------------------------------------------------------------------------------
+    def set_station(self, station_code, stage, status, done=False):
+        self.execute('INSERT INTO run_stations (run_id, station_code, stage, status, done) VALUES (?, ?, ?, ?, ?) '
+                     'ON CONFLICT (run_id, station_code) DO UPDATE SET stage = excluded.stage, '
+                     'status = excluded.status, done = MAX(done, excluded.done)',
+                     (self.run_id, station_code, stage, status, int(done)))
+
+    def get_done_stations(self):
+        rows = self.execute('SELECT station_code FROM run_stations WHERE run_id = ? AND done = 1', (self.run_id,))
+        return set(row[0] for row in rows)
+
+    ##--------------------------------------------------------------------------------
+    def set_queries(self, station_code, list_queries):
+        with self.lock:
+            self.conn.executemany('INSERT OR IGNORE INTO run_queries (run_id, station_code, query) VALUES (?, ?, ?)',
+                                  [(self.run_id, station_code, query.decode('utf-8')) for query in list_queries])
+            self.conn.commit()
+
+    def get_queries(self, station_code, remaining_only=False):
+        """
+        return:
+            list of queries (bytes) in the planned order, None if none were planned
+        """
+        sql = 'SELECT query FROM run_queries WHERE run_id = ? AND station_code = ?'
+        if remaining_only:
+            sql += ' AND done = 0'
+        rows = self.execute(sql + ' ORDER BY rowid', (self.run_id, station_code))
+        if not rows and not remaining_only:
+            return None
+        return [row[0].encode('utf-8') for row in rows]
+
+    def set_query_done(self, station_code, query, records):
+        """
+        query_callback for get_gap_data_from_station - keep the records returned for the query
+        """
+        self.execute('UPDATE run_queries SET done = 1, records = ? WHERE run_id = ? AND station_code = ? AND query = ?',
+                     (json.dumps(records), self.run_id, station_code, query.decode('utf-8')))
+
+    def get_records(self, station_code):
+        """
+        return:
+            list of logger records from all answered queries (input for gap_data_formatter)
+        """
+        rows = self.execute('SELECT records FROM run_queries WHERE run_id = ? AND station_code = ? AND done = 1 '
+                            'ORDER BY rowid', (self.run_id, station_code))
+        records = []
+        for row in rows:
+            records.extend(json.loads(row[0]))
+        return records
+
+    ##--------------------------------------------------------------------------------
+    def set_messages(self, station_code, messages):
+        """
+        Keep the messages built for a station, replacing the ones built before 
+        A message that is the same as one acknowledged before stays acknowledged 
+        """
+        with self.lock:
+            acknowledged = set(row[0] for row in self.conn.execute(
+                'SELECT message FROM run_messages WHERE run_id = ? AND station_code = ? AND acknowledged = 1',
+                (self.run_id, station_code)).fetchall())
+            self.conn.execute('DELETE FROM run_messages WHERE run_id = ? AND station_code = ?',
+                              (self.run_id, station_code))
+            self.conn.executemany('INSERT INTO run_messages (run_id, station_code, idx, message, acknowledged) '
+                                  'VALUES (?, ?, ?, ?, ?)',
+                                  [(self.run_id, station_code, idx, message, int(message in acknowledged))
+                                   for idx, message in enumerate(messages)])
+            self.conn.commit()
+
+    def get_messages(self, station_code, unacknowledged_only=False):
+        """
+        return:
+            list of (idx, message), None if no messages were built
+        """
+        sql = 'SELECT idx, message FROM run_messages WHERE run_id = ? AND station_code = ?'
+        if unacknowledged_only:
+            sql += ' AND acknowledged = 0'
+        rows = self.execute(sql + ' ORDER BY idx', (self.run_id, station_code))
+        if not rows and not unacknowledged_only:
+            return None
+        return rows
+
+    def set_message_acknowledged(self, station_code, idx):
+        self.execute('UPDATE run_messages SET acknowledged = 1 WHERE run_id = ? AND station_code = ? AND idx = ?',
+                     (self.run_id, station_code, idx))
+
+    def get_summary(self):
+        """
+        Progress of the run per station
+        return:
+            Pandas dataframe with columns station_code, stage, status, done, queries, queries_done, messages, messages_acknowledged
+        """
+        rows = self.execute("""
+            SELECT s.station_code, s.stage, s.status, s.done,
+                (SELECT COUNT(*) FROM run_queries q WHERE q.run_id = s.run_id
+                    AND (q.station_code = s.station_code OR q.station_code LIKE s.station_code || '/%')),
+                (SELECT COUNT(*) FROM run_queries q WHERE q.run_id = s.run_id AND q.done = 1
+                    AND (q.station_code = s.station_code OR q.station_code LIKE s.station_code || '/%')),
+                (SELECT COUNT(*) FROM run_messages m WHERE m.run_id = s.run_id AND m.station_code = s.station_code),
+                (SELECT COUNT(*) FROM run_messages m WHERE m.run_id = s.run_id AND m.station_code = s.station_code AND m.acknowledged = 1)
+            FROM run_stations s WHERE s.run_id = ? ORDER BY s.station_code""", (self.run_id,))
+        return pd.DataFrame(rows, columns=['station_code','stage','status','done','queries','queries_done',
+                                           'messages','messages_acknowledged'])
+
+# ---------------------------------------------------------------------------------------
+# Cache of the raw logger responses 
+# Querying the loggers is the slowest part of the gap fill (cellular telnet, up to 25 s 
+# per query), so the validated records are kept per station and query. The query holds 
+# the time window (and the log file) - records are stored before any sensor filtering, so 
+# re-formatting after a sensor map fix or re-sending to another iwls_environment can 
+# use them without calling the station again.
+# Answers are only used for RESPONSE_CACHE_MAX_AGE_HOURS - a logger that had no data 
+# yet may have it now, so empty answers are never kept.
+# ---------------------------------------------------------------------------------------
+RESPONSE_CACHE_MAX_AGE_HOURS = 24
+
+class LoggerResponseCache:
+    """
+    SQLite cache of validated logger records per logger (get_logger_key) and query
+
+    Usage:
+        cache = LoggerResponseCache('gapfill_cache.db')
+        df, metadata, status = get_gap_data_from_station_cached(metadata, list_queries, 0, cache)
+    """
+
+    def __init__(self, db_file='gapfill_cache.db'):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                station_code TEXT NOT NULL,
+                query TEXT NOT NULL,
+                records TEXT NOT NULL,
+                retrieved TEXT NOT NULL,
+                PRIMARY KEY (station_code, query)
+            )""")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, station_code, query, max_age_hours=RESPONSE_CACHE_MAX_AGE_HOURS):
+        """
+        return:
+            list of records for the query, None if not cached (or older than max_age_hours, None for any age)
+        """
+        sql = 'SELECT records FROM responses WHERE station_code = ? AND query = ?'
+        params = [station_code, query.decode('utf-8')]
+        if max_age_hours is not None:
+            sql += ' AND retrieved >= ?'
+            params.append((datetime.utcnow() - timedelta(hours=max_age_hours)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+        with self.lock:
+            row = self.conn.execute(sql, params).fetchone()
+        # An empty answer kept by an older version - not worth using
+        if row is None or row[0] == '[]':
+            return None
+        return json.loads(row[0])
+
+    def put(self, station_code, query, records):
+        # Nothing came back - ask the logger again next time 
+        if not records:
+            return
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses (station_code, query, records, retrieved) '
+                              'VALUES (?, ?, ?, ?)',
+                              (station_code, query.decode('utf-8'), json.dumps(records),
+                               datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')))
+            self.conn.commit()
+
+    def purge(self, older_than_days=30, station_code=None):
+        """
+        Remove old entries (or all entries for a station with older_than_days=0)
+        return:
+            number of entries removed
+        """
+        sql = 'DELETE FROM responses WHERE retrieved < ?'
+        params = [(datetime.utcnow() - timedelta(days=older_than_days)).strftime('%Y-%m-%dT%H:%M:%SZ')]
+        if station_code is not None:
+            sql += ' AND station_code = ?'
+            params.append(station_code)
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+        return cursor.rowcount
+
+##--------------------------------------------------------------------------------
+def get_gap_data_from_station_cached(metadata, list_queries, strike, cache, query_callback=None,
+                                     max_age_hours=RESPONSE_CACHE_MAX_AGE_HOURS,
+                                     health=None, pacer=None, sensor_map=None):
+    """
+    Same as get_gap_data_from_station, but queries found in the cache are not sent
+    to the logger, and new answers are added to the cache
+    params:
+        metadata, list_queries, strike, query_callback = see get_gap_data_from_station
+        cache = LoggerResponseCache
+        max_age_hours = ignore cached answers older than this 
+        health = StationHealth - see get_gap_data_from_station_checked
+        pacer = QueryPacer - see get_gap_data_from_station
+        sensor_map = SensorMapCache - see get_gap_data_from_station
+    return:
+        formatted gap data (dataframe), metadata, status message
+    """
+    records = []
+    remaining = []
+    for query in list_queries:
+        cached = cache.get(get_logger_key(metadata), query, max_age_hours)
+        if cached is None:
+            remaining.append(query)
+            continue
+        records.extend(cached)
+        if query_callback is not None:
+            query_callback(query, cached)
+
+    status = 'Good'
+    if remaining:
+        def callback(query, query_records):
+            cache.put(get_logger_key(metadata), query, query_records)
+            records.extend(query_records)
+            if query_callback is not None:
+                query_callback(query, query_records)
+        df, metadata, status = get_gap_data_from_station_checked(metadata, remaining, strike, health, callback, pacer,
+                                                                 sensor_map)
+    logging.info(f'{metadata.officialName} {metadata.code}: {len(list_queries) - len(remaining)} '
+                 f'of {len(list_queries)} queries from the cache')
+
+    if not records:
+        if not remaining:
+            status = f'{metadata.officialName} {metadata.code}: Queries were run, but, no data received'
+        return None, metadata, status
+
+    return api.gap_data_formatter(records, metadata.sutron_sensors), metadata, status
+
+# ---------------------------------------------------------------------------------------
+# Sensor map cache 
+# The sensor names come from the key value pairs, which can drift from the .bas push 
+# file actually running in the logger. Downloading the .bas file every run is slow on 
+# cellular, so the parsed map is kept per station and file along with its DIR listing 
+# (size and modification time). get_gap_data_from_station only downloads the file again 
+# when the listing changed - see IWLS_API_Tools.get_sensor_map_from_logger
+# ---------------------------------------------------------------------------------------
+class SensorMapCache:
+    """
+    SQLite cache of the sensor maps parsed from the .bas files
+
+    Usage:
+        sensor_map = SensorMapCache('gapfill_sensors.db')
+        df, metadata, status = api.get_gap_data_from_station(metadata, list_queries, 0, sensor_map=sensor_map)
+        print(sensor_map.get_maps())
+    """
+
+    def __init__(self, db_file='gapfill_sensors.db'):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS sensor_maps (
+                station_code TEXT NOT NULL,
+                basic_file_name TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                checksum TEXT,
+                sutron_sensors TEXT NOT NULL,
+                iwls_sensors TEXT NOT NULL,
+                fetched TEXT NOT NULL,
+                checked TEXT NOT NULL,
+                PRIMARY KEY (station_code, basic_file_name)
+            )""")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, station_code, basic_file_name, signature):
+        """
+        return:
+            (sutron_sensors, iwls_sensors), None if not cached or the file changed
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT signature, sutron_sensors, iwls_sensors FROM sensor_maps '
+                                    'WHERE station_code = ? AND basic_file_name = ?',
+                                    (station_code, basic_file_name)).fetchone()
+            if row is None or row[0] != signature:
+                return None
+            self.conn.execute('UPDATE sensor_maps SET checked = ? WHERE station_code = ? AND basic_file_name = ?',
+                              (datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), station_code, basic_file_name))
+            self.conn.commit()
+        return json.loads(row[1]), json.loads(row[2])
+
+    def put(self, station_code, basic_file_name, signature, sutron_sensors, iwls_sensors, checksum=None):
+        now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO sensor_maps (station_code, basic_file_name, signature, checksum, '
+                              'sutron_sensors, iwls_sensors, fetched, checked) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (station_code, basic_file_name, signature, checksum,
+                               json.dumps(list(sutron_sensors)), json.dumps(list(iwls_sensors)), now, now))
+            self.conn.commit()
+
+    def invalidate(self, station_code=None):
+        """
+        Forget the maps (for a station, or all) so the .bas files are downloaded again
+        """
+        sql = 'DELETE FROM sensor_maps'
+        params = []
+        if station_code is not None:
+            sql += ' WHERE station_code = ?'
+            params.append(station_code)
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def get_maps(self):
+        """
+        return:
+            Pandas dataframe with columns station_code, basic_file_name, signature, checksum, 
+            sutron_sensors, iwls_sensors, fetched, checked
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT station_code, basic_file_name, signature, checksum, sutron_sensors, '
+                                     'iwls_sensors, fetched, checked FROM sensor_maps ORDER BY station_code').fetchall()
+        df = pd.DataFrame(rows, columns=['station_code','basic_file_name','signature','checksum',
+                                         'sutron_sensors','iwls_sensors','fetched','checked'])
+        df['sutron_sensors'] = df['sutron_sensors'].apply(json.loads)
+        df['iwls_sensors'] = df['iwls_sensors'].apply(json.loads)
+        return df
+
+# ---------------------------------------------------------------------------------------
+# Station health and circuit breaker 
+# A station that is down costs the full telnet connect and read_until timeouts every 
+# time it is tried. After failure_threshold connection failures in a row the circuit 
+# is OPEN and the station fails fast. When the open period is over a cheap probe 
+# (TCP connect only) is made - HALF_OPEN - and only if it answers is the real 
+# retrieval tried. Each time the circuit opens again the open period doubles.
+# ---------------------------------------------------------------------------------------
+# Status messages from get_gap_data_from_station that mean we never got to talk to the logger 
+UNREACHABLE_STATUS = ['Could not create the Telnet connection',
+                      'Socket Timeout - Login User',
+                      'Socket Timeout - Waiting for Initial Flash Disk prompt']
+
+class StationHealth:
+    """
+    SQLite health tracker and circuit breaker per logger (get_logger_key)
+
+    Usage:
+        health = StationHealth('gapfill_health.db')
+        df, metadata, status = get_gap_data_from_station_checked(metadata, list_queries, 0, health)
+        print(health.get_health())
+    """
+
+    def __init__(self, db_file='gapfill_health.db', failure_threshold=3, open_minutes=30,
+                 max_open_minutes=24*60, probe_timeout=5):
+        """
+        params:
+            failure_threshold = connection failures in a row before the circuit opens
+            open_minutes = first open period, doubled each time the circuit opens again
+            max_open_minutes = longest open period
+            probe_timeout = seconds to wait for the TCP connect of the half open probe
+        """
+        self.db_file = db_file
+        self.failure_threshold = failure_threshold
+        self.open_minutes = open_minutes
+        self.max_open_minutes = max_open_minutes
+        self.probe_timeout = probe_timeout
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS health (
+                station_code TEXT PRIMARY KEY,
+                state TEXT NOT NULL DEFAULT 'CLOSED',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                successes INTEGER NOT NULL DEFAULT 0,
+                consecutive_failures INTEGER NOT NULL DEFAULT 0,
+                times_opened INTEGER NOT NULL DEFAULT 0,
+                open_until TEXT,
+                seconds_total REAL NOT NULL DEFAULT 0,
+                connect_ms_total REAL NOT NULL DEFAULT 0,
+                connects INTEGER NOT NULL DEFAULT 0,
+                probes INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                last_error_time TEXT,
+                last_success TEXT
+            )""")
+        try:
+            # Health file from before connects was kept 
+            self.conn.execute('ALTER TABLE health ADD COLUMN connects INTEGER NOT NULL DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get_row(self, station_code):
+        self.conn.execute('INSERT OR IGNORE INTO health (station_code) VALUES (?)', (station_code,))
+        return self.conn.execute('SELECT state, consecutive_failures, times_opened, open_until FROM health '
+                                 'WHERE station_code = ?', (station_code,)).fetchone()
+
+    def probe(self, metadata):
+        """
+        Cheap check the logger answers - TCP connect only, no login 
+        return:
+            True / False, connect time in milliseconds, error message
+        """
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((metadata.ip_address, int(metadata.port)), timeout=self.probe_timeout):
+                pass
+        except (OSError, ValueError, TypeError) as e:
+            return False, None, f'Probe failed: {e}'
+        return True, round((time.perf_counter() - start) * 1000, 1), ''
+
+    def open_circuit(self, station_code, times_opened, error):
+        minutes = min(self.open_minutes * 2 ** times_opened, self.max_open_minutes)
+        now = datetime.utcnow()
+        open_until = (now + timedelta(minutes=minutes)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.conn.execute("UPDATE health SET state = 'OPEN', times_opened = times_opened + 1, open_until = ?, "
+                          "last_error = ?, last_error_time = ? WHERE station_code = ?",
+                          (open_until, error, now.strftime('%Y-%m-%dT%H:%M:%SZ'), station_code))
+        logging.info(f'{station_code}: Circuit open until {open_until} ({error})')
+
+    def is_open(self, station_code):
+        """
+        True if the circuit is open and the open period is not over (no probe is made)
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT state, open_until FROM health WHERE station_code = ?',
+                                    (station_code,)).fetchone()
+        if row is None or row[0] != 'OPEN':
+            return False
+        return row[1] > datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def allow(self, metadata):
+        """
+        Can we try the station now ?
+        return:
+            True / False, reason (empty if allowed)
+        """
+        station_code = get_logger_key(metadata)
+        with self.lock:
+            state, failures, times_opened, open_until = self.get_row(station_code)
+            self.conn.commit()
+            if state != 'OPEN':
+                return True, ''
+            if open_until > datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'):
+                return False, f'{metadata.officialName} {station_code}: Circuit open until {open_until}'
+
+        # Open period is over - probe before paying for the full retrieval 
+        ok, connect_ms, error = self.probe(metadata)
+        with self.lock:
+            if ok:
+                self.conn.execute("UPDATE health SET state = 'HALF_OPEN', probes = probes + 1, connects = connects + 1, "
+                                  "connect_ms_total = connect_ms_total + ? WHERE station_code = ?",
+                                  (connect_ms, station_code))
+            else:
+                self.conn.execute('UPDATE health SET probes = probes + 1 WHERE station_code = ?', (station_code,))
+                self.open_circuit(station_code, times_opened, error)
+            self.conn.commit()
+        if not ok:
+            return False, f'{metadata.officialName} {station_code}: {error}'
+        return True, ''
+
+    def record(self, station_code, status, seconds, connect_ms=None):
+        """
+        Record the result of get_gap_data_from_station
+        params:
+            status = status message returned by get_gap_data_from_station
+            seconds = time taken
+            connect_ms = time taken to open the telnet connection (None if it did not open)
+        """
+        unreachable = any(s in status for s in UNREACHABLE_STATUS)
+        now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        with self.lock:
+            state, failures, times_opened, open_until = self.get_row(station_code)
+            if connect_ms is not None:
+                self.conn.execute('UPDATE health SET connects = connects + 1, connect_ms_total = connect_ms_total + ? '
+                                  'WHERE station_code = ?', (connect_ms, station_code))
+            if not unreachable:
+                # We talked to the logger - close the circuit 
+                self.conn.execute("UPDATE health SET state = 'CLOSED', attempts = attempts + 1, "
+                                  "successes = successes + ?, consecutive_failures = 0, times_opened = 0, "
+                                  "seconds_total = seconds_total + ?, last_success = ? WHERE station_code = ?",
+                                  (1 if status == 'Good' else 0, seconds, now, station_code))
+                if status != 'Good':
+                    self.conn.execute('UPDATE health SET last_error = ?, last_error_time = ? WHERE station_code = ?',
+                                      (status, now, station_code))
+            else:
+                self.conn.execute('UPDATE health SET attempts = attempts + 1, consecutive_failures = consecutive_failures + 1, '
+                                  'seconds_total = seconds_total + ?, last_error = ?, last_error_time = ? '
+                                  'WHERE station_code = ?', (seconds, status, now, station_code))
+                # A failed half open try re-opens straight away 
+                if state == 'HALF_OPEN' or failures + 1 >= self.failure_threshold:
+                    self.open_circuit(station_code, times_opened, status)
+            self.conn.commit()
+
+    def get_health(self):
+        """
+        return:
+            Pandas dataframe with one row per station: state, success_rate, avg_seconds, 
+            avg_connect_ms (from the connections and the probes), last_error, last_success, open_until ...
+        """
+        with self.lock:
+            cursor = self.conn.execute('SELECT * FROM health ORDER BY station_code')
+            columns = [c[0] for c in cursor.description]
+            df = pd.DataFrame(cursor.fetchall(), columns=columns)
+        attempts = df['attempts'].where(df['attempts'] > 0)
+        df['success_rate'] = (df['successes'] / attempts).round(2)
+        df['avg_seconds'] = (df['seconds_total'] / attempts).round(1)
+        df['avg_connect_ms'] = (df['connect_ms_total'] / df['connects'].where(df['connects'] > 0)).round(1)
+        return df.drop(columns=['seconds_total','connect_ms_total'])
+
+##--------------------------------------------------------------------------------
+def get_gap_data_from_station_checked(metadata, list_queries, strike, health, query_callback=None, pacer=None,
+                                      sensor_map=None):
+    """
+    Same as get_gap_data_from_station, but known dead stations fail fast and 
+    the result is recorded in the station health 
+    params:
+        metadata, list_queries, strike, query_callback, pacer, sensor_map = see get_gap_data_from_station
+        health = StationHealth (None to call get_gap_data_from_station directly)
+    return:
+        formatted gap data (dataframe), metadata, status message
+    """
+    if health is None:
+        return api.get_gap_data_from_station(metadata, list_queries, strike, query_callback, pacer, sensor_map)
+
+    allowed, reason = health.allow(metadata)
+    if not allowed:
+        return None, metadata, reason
+
+    start = time.perf_counter()
+    timings = {}
+    df, metadata, status = api.get_gap_data_from_station(metadata, list_queries, strike, query_callback, pacer,
+                                                         sensor_map, timings)
+    health.record(get_logger_key(metadata), status, time.perf_counter() - start, timings.get('connect_ms'))
+    return df, metadata, status
+
+# ---------------------------------------------------------------------------------------
+# Adaptive query pacing for the Sutron loggers 
+# Some loggers start to garble their answers after ~15 queries in a row. Instead of a 
+# fixed sleep for every station, the pacer learns per station:
+#   - delay between queries: doubled after a failed query, reduced by delay_step 
+#     after success_streak good queries in a row
+#   - query size (hours per query): halved when a failed answer was at least as big 
+#     as the biggest good answer seen (the reply is probably too big for the link), 
+#     doubled again after a streak of good queries once the delay is back to 0
+# Healthy stations end up with no delay and full day queries.
+# ---------------------------------------------------------------------------------------
+class QueryPacer:
+    """
+    SQLite backed pacing per station, used by get_gap_data_from_station (pacer=) 
+    and get_list_of_queries (frequency=pacer.get_frequency(station_code))
+    """
+
+    def __init__(self, db_file='gapfill_pacing.db', max_delay=10.0, delay_step=0.5, success_streak=5,
+                 min_query_hours=1, max_query_hours=24):
+        self.db_file = db_file
+        self.max_delay = max_delay
+        self.delay_step = delay_step
+        self.success_streak = success_streak
+        self.min_query_hours = min_query_hours
+        self.max_query_hours = max_query_hours
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pacing (
+                station_code TEXT PRIMARY KEY,
+                delay REAL NOT NULL,
+                query_hours REAL NOT NULL,
+                streak INTEGER NOT NULL,
+                queries INTEGER NOT NULL,
+                failures INTEGER NOT NULL,
+                max_good_reply_bytes INTEGER NOT NULL,
+                seconds_total REAL NOT NULL
+            )""")
+        self.conn.commit()
+        self.columns = ['station_code','delay','query_hours','streak','queries','failures',
+                        'max_good_reply_bytes','seconds_total']
+        self.pacing = {}
+        for row in self.conn.execute('SELECT ' + ','.join(self.columns) + ' FROM pacing'):
+            self.pacing[row[0]] = dict(zip(self.columns, row))
+
+    def close(self):
+        self.conn.close()
+
+    def get_state(self, station_code):
+        return self.pacing.setdefault(station_code, {'station_code': station_code, 'delay': 0.0,
+                                                     'query_hours': self.max_query_hours, 'streak': 0,
+                                                     'queries': 0, 'failures': 0,
+                                                     'max_good_reply_bytes': 0, 'seconds_total': 0.0})
+
+    def get_frequency(self, station_code):
+        """
+        Longest time span of a single query for the station (frequency for get_list_of_queries)
+        """
+        with self.lock:
+            hours = self.get_state(station_code)['query_hours']
+        if hours >= 24:
+            return '1D'
+        return f'{int(hours * 60)}min'
+
+    def before_query(self, station_code):
+        with self.lock:
+            delay = self.get_state(station_code)['delay']
+        if delay > 0:
+            time.sleep(delay)
+
+    def after_query(self, station_code, ok, reply_bytes, seconds):
+        with self.lock:
+            p = self.get_state(station_code)
+            p['queries'] += 1
+            p['seconds_total'] += seconds
+            if ok:
+                p['streak'] += 1
+                p['max_good_reply_bytes'] = max(p['max_good_reply_bytes'], reply_bytes)
+                if p['streak'] >= self.success_streak:
+                    p['streak'] = 0
+                    if p['delay'] > 0:
+                        p['delay'] = max(0.0, p['delay'] - self.delay_step)
+                    else:
+                        p['query_hours'] = min(self.max_query_hours, p['query_hours'] * 2)
+            else:
+                p['streak'] = 0
+                p['failures'] += 1
+                p['delay'] = min(self.max_delay, max(self.delay_step, p['delay'] * 2))
+                if reply_bytes >= p['max_good_reply_bytes']:
+                    p['query_hours'] = max(self.min_query_hours, p['query_hours'] / 2)
+                logging.info(f'{station_code}: Query failed - delay now {p["delay"]} s, '
+                             f'{p["query_hours"]} hours per query')
+
+            self.conn.execute('INSERT OR REPLACE INTO pacing (' + ','.join(self.columns) + ') VALUES (?,?,?,?,?,?,?,?)',
+                              [p[c] for c in self.columns])
+            self.conn.commit()
+
+    def get_pacing(self):
+        """
+        return:
+            Pandas dataframe with the learned delay and query size for each station
+        """
+        with self.lock:
+            df = pd.DataFrame(list(self.pacing.values()), columns=self.columns)
+        df['failure_rate'] = (df['failures'] / df['queries'].where(df['queries'] > 0)).round(2)
+        df['avg_seconds'] = (df['seconds_total'] / df['queries'].where(df['queries'] > 0)).round(1)
+        return df.drop(columns=['seconds_total']).sort_values('station_code')
+
+##--------------------------------------------------------------------------------
+def get_station_object(metadata):
+    """
+    get_gap_data_from_station uses attributes i.e. metadata.sutron_sensors, 
+    but get_all_metadata_for_key_value returns dicts - convert if needed 
+    params:
+        metadata = metadata dict or StationMetaData object
+    return:
+        StationMetaData object
+    """
+    if isinstance(metadata, dict):
+        return api.StationMetaData.from_dict(metadata)
+    return metadata
+
+##--------------------------------------------------------------------------------
+def get_retrieval_units(metadata):
+    """
+    Split a station with more than one datalogger / log file into retrieval units
+    i.e. ip_address = '10.0.0.1;10.0.0.2', log_name = 'ssp;ssp'
+    ip_address, port, log_name and basic_file_name can each hold one value per 
+    logger separated by ';' - a single value is used for all the loggers 
+    Only ip_address, port and log_name make a new unit - a station with several 
+    .bas files on one logger / log (07120_DL1_...bas;07120_DL2_...bas) is one unit, 
+    the logger would be asked for the same records once per .bas file 
+    params:
+        metadata = StationMetaData object
+    return:
+        list of StationMetaData objects, one per logger / log file
+        A station with a single logger returns [metadata]
+    """
+    fields = ['ip_address','port','log_name','basic_file_name']
+    values = {}
+    for field in fields:
+        value = getattr(metadata, field, None)
+        values[field] = str(value).split(';') if value else [value]
+
+    count = max(len(values[field]) for field in ['ip_address','port','log_name'])
+    if count == 1:
+        return [metadata]
+
+    units = []
+    seen = set()
+    for i in range(count):
+        unit = copy.copy(metadata)
+        for field in ['ip_address','port','log_name']:
+            v = values[field][i] if i < len(values[field]) else values[field][-1]
+            setattr(unit, field, v.strip() if v else v)
+        # One .bas file per logger, or the whole list if they don't line up
+        name = None
+        if len(values['basic_file_name']) == count:
+            v = values['basic_file_name'][i]
+            unit.basic_file_name = v.strip() if v else v
+            # Name the unit after the logger in the basic file name (DL1, DL2 ...) if we can
+            name = re.search(r'DL\d+', unit.basic_file_name or '')
+
+        # Same logger and log twice - query it once
+        connection = (unit.ip_address, unit.port, unit.log_name)
+        if connection in seen:
+            continue
+        seen.add(connection)
+
+        unit.unit = name.group(0) if name else str(i + 1)
+
+        # NOTE: special case - backwards compatibility  
+        unit.ip = unit.ip_address
+        unit.xconnectlogfile = unit.log_name
+        units.append(unit)
+
+    if len(units) == 1:
+        # Only one logger after all - keep the station key
+        units[0].unit = ''
+    return units
+
+def get_logger_key(metadata):
+    """
+    Key used for everything kept per logger (cache, health, checkpoint)
+    i.e. '07120' for a single logger station, '07120/DL2' for a unit
+    """
+    unit = getattr(metadata, 'unit', '')
+    return f'{metadata.code}/{unit}' if unit else metadata.code
+
+# ---------------------------------------------------------------------------------------
+# Reconciliation with IWLS 
+# IWLS may already have some of the data we got from the logger (GOES, a previous run, 
+# someone else filling the same gap), so before sending only the rows still inside a 
+# gap are kept. After sending, the gaps are checked again to see how much was filled.
+# ---------------------------------------------------------------------------------------
+def get_gaps_for_span(station, ts_id, start, end):
+    """
+    Gaps in IWLS for a time span 
+    params:
+        station = StationMetaData object
+        ts_id = time series id (get_timeseries_id)
+        start, end = datetimes (UTC)
+    return:
+        Pandas dataframe of gaps (empty if there are none)
+        None if IWLS could not be asked - the caller should not drop anything
+    """
+    try:
+        df_gaps = api.find_data_gaps(station.id, ts_id, start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                     end.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    except Exception as e:
+        logging.info(f'{station.officialName} {station.code}: Could not get the gaps to reconcile - {e}')
+        return None
+    if df_gaps.empty:
+        return df_gaps
+    if not all(item in df_gaps.columns for item in ['start','end']):
+        return None
+    return df_gaps
+
+def get_in_gaps(times, df_gaps):
+    """
+    return:
+        boolean Pandas series - True where the time is inside one of the gaps
+    """
+    times = pd.Series(times).reset_index(drop=True)
+    mask = pd.Series(False, index=times.index)
+    if df_gaps.empty:
+        return mask
+    for start, end in zip(df_gaps['start'], df_gaps['end']):
+        mask |= (times >= start) & (times <= end)
+    return mask
+
+def reconcile_gap_data(station, df, ts_id):
+    """
+    Drop the rows of the logger data IWLS already has
+    params:
+        station = StationMetaData object
+        df = gap data from gap_data_formatter
+        ts_id = time series id (get_timeseries_id)
+    return:
+        gap data still missing in IWLS, number of rows dropped
+    """
+    if df is None or df.empty:
+        return df, 0
+    times = pd.to_datetime(df['WaterLevelDate'], format='%m/%d/%Y %H:%M:%S')
+    df_gaps = get_gaps_for_span(station, ts_id, times.min(), times.max())
+    if df_gaps is None:
+        # Could not check - send everything like before 
+        return df, 0
+
+    mask = get_in_gaps(times, df_gaps)
+    redundant = int((~mask).sum())
+    if redundant:
+        logging.info(f'{station.officialName} {station.code}: {redundant} of {len(df)} rows already in IWLS')
+    return df[mask.values], redundant
+
+def verify_fill(station, messages, ts_id):
+    """
+    Check the gaps again after sending - how many of the rows sent are in IWLS now 
+    params:
+        station = StationMetaData object
+        messages = messages sent
+        ts_id = time series id (get_timeseries_id)
+    return:
+        dict with rows_sent, rows_filled, fill_ratio
+        None if IWLS could not be asked
+    """
+    times = sorted(set(t for message in messages for t in get_message_times(message)))
+    if not times:
+        return None
+    df_gaps = get_gaps_for_span(station, ts_id, times[0], times[-1])
+    if df_gaps is None:
+        return None
+
+    rows_filled = len(times) - int(get_in_gaps(times, df_gaps).sum())
+    return {'rows_sent': len(times), 'rows_filled': rows_filled,
+            'fill_ratio': round(rows_filled / len(times), 3)}
+
+# ---------------------------------------------------------------------------------------
+# Staged GapFill pipeline 
+# Each stage has its own workers and a bounded queue in front of it:
+#     gaps   - get_data_gaps / get_list_of_queries          (HTTP)
+#     telnet - get_gap_data_from_station                    (slow telnet to the loggers)
+#     format - pack_messages                                (CPU)
+#     send   - send_messages_to_IWLS_bulk or MessageOutbox  (HTTP)
+# A slow logger only ties up one telnet worker, the other stages keep going
+# ---------------------------------------------------------------------------------------
+class GapFillPipeline:
+    """
+    Run the gap fill for a list of stations
+
+    Usage:
+        stations = api.get_all_metadata_for_key_value('ip_enabled', 'True', 'prod', region='PAC')
+        pipeline = GapFillPipeline('2025-01-24T00:00:00Z', '2025-01-31T00:00:00Z')
+        df_results = pipeline.run(stations)
+        print(pipeline.get_stats())
+    """
+
+    STAGES = ['gaps', 'telnet', 'format', 'send']
+    # Statuses that leave nothing to do for the station (besides 'Good' after sending)
+    DONE_STATUSES = ['No gaps', 'Already in IWLS']
+
+    def __init__(self, start_time, end_time, iwls_environment=None, time_series_code='wlo',
+                 gap_workers=4, telnet_workers=16, format_workers=2, send_workers=2,
+                 queue_size=32, outbox=None, checkpoint=None, response_cache=None,
+                 cache_max_age_hours=RESPONSE_CACHE_MAX_AGE_HOURS, health=None, pacer=None,
+                 sensor_map=None, reconcile=False, verify=False, verify_delay=0,
+                 max_bytes=api.IWLS_MESSAGE_MAX_BYTES, max_rows=api.IWLS_MESSAGE_MAX_ROWS):
+        """
+        params:
+            start_time, end_time = gap window, ISO 8601 format UTC (e.g.: 2019-11-13T19:18:00Z)
+            iwls_environment = one of "dev","test","prod", None to use each station's iwls_environment key
+            time_series_code = time series to look for gaps in 
+            gap_workers, telnet_workers, format_workers, send_workers = number of workers per stage
+            queue_size = maximum number of stations waiting in front of each stage
+            outbox = MessageOutbox - if given messages are stored there before sending
+            checkpoint = GapFillCheckpoint - if given progress is saved so the run can be resumed
+            response_cache = LoggerResponseCache - if given cached logger answers are used instead of querying again
+            cache_max_age_hours = cached logger answers older than this are not used 
+            health = StationHealth - if given stations with an open circuit are skipped
+            pacer = QueryPacer - if given queries are sized and paced for each station
+            sensor_map = SensorMapCache - if given the sensor map is checked against the .bas file in the logger
+            reconcile = drop the rows IWLS already has before sending (see reconcile_gap_data)
+            verify = check the gaps again after sending and keep the fill ratio (see verify_fill)
+            verify_delay = seconds to wait before verifying, to let IWLS ingest the messages 
+                           (once, after all the stations are sent)
+            max_bytes, max_rows = message limits, see pack_messages
+        """
+        self.start_time = start_time
+        self.end_time = end_time
+        self.iwls_environment = iwls_environment
+        self.time_series_code = time_series_code
+        self.workers = {'gaps': gap_workers, 'telnet': telnet_workers,
+                        'format': format_workers, 'send': send_workers}
+        self.queue_size = queue_size
+        self.outbox = outbox
+        self.checkpoint = checkpoint
+        self.response_cache = response_cache
+        self.cache_max_age_hours = cache_max_age_hours
+        self.health = health
+        self.pacer = pacer
+        self.sensor_map = sensor_map
+        self.reconcile = reconcile
+        self.verify = verify
+        self.verify_delay = verify_delay
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+
+        self.lock = threading.Lock()
+        self.results = {}
+        self.stats = {}
+        self.ts_ids = {}
+        self.to_verify = []
+
+    def set_result(self, station, stage, status, **kwargs):
+        # Keep the last stage reached and the status for each station 
+        with self.lock:
+            result = self.results.setdefault(station.code, {'code': station.code,
+                                                            'name': station.officialName})
+            result['stage'] = stage
+            result['status'] = status
+            result.update(kwargs)
+        if self.checkpoint is not None:
+            self.checkpoint.set_station(station.code, stage, status)
+
+    ##--------------------------------------------------------------------------------
+    # The stages - each takes a station and its data and returns what the next 
+    # stage needs, or None if the station is done 
+    def find_gaps(self, station):
+        # Resuming - the queries are already planned 
+        if self.checkpoint is not None:
+            units_queries = [(unit, self.checkpoint.get_queries(get_logger_key(unit)))
+                             for unit in get_retrieval_units(station)]
+            if all(list_queries is not None for unit, list_queries in units_queries):
+                self.set_result(station, 'gaps', 'Resumed', queries=sum(len(q) for u, q in units_queries))
+                return station, units_queries
+
+        ts_id = self.get_timeseries_id(station)
+        if ts_id is None:
+            self.set_result(station, 'gaps', f'No {self.time_series_code} time series')
+            return None
+
+        df_gaps = api.get_data_gaps(station.id, ts_id, self.start_time, self.end_time)
+        if df_gaps is None or df_gaps.empty:
+            self.set_result(station, 'gaps', 'No gaps')
+            return None
+
+        units_queries = self.plan_queries(station, df_gaps)
+        if self.checkpoint is not None:
+            for unit, list_queries in units_queries:
+                self.checkpoint.set_queries(get_logger_key(unit), list_queries)
+        self.set_result(station, 'gaps', 'Gaps found', gaps=len(df_gaps),
+                        queries=sum(len(q) for u, q in units_queries))
+        return station, units_queries
+
+    def retrieve(self, item):
+        station, units_queries = item
+        records, status = self.retrieve_units(station, units_queries)
+
+        # All loggers merged into one frame for the station 
+        if not records:
+            self.set_result(station, 'telnet', status)
+            return None
+        # The same record from two queries / loggers would be joined into one bad value by the pivot
+        records = list(dict.fromkeys(records))
+        df = api.gap_data_formatter(records, station.sutron_sensors)
+        self.set_result(station, 'telnet', status, rows=len(df))
+        return station, df
+
+    def get_gap_data(self, station, list_queries, query_callback=None):
+        # Go through the cache if we have one 
+        if self.response_cache is not None:
+            return get_gap_data_from_station_cached(station, list_queries, 0, self.response_cache, query_callback,
+                                                    self.cache_max_age_hours, health=self.health, pacer=self.pacer, sensor_map=self.sensor_map)
+        return get_gap_data_from_station_checked(station, list_queries, 0, self.health, query_callback, self.pacer,
+                                                 self.sensor_map)
+
+    def get_timeseries_id(self, station):
+        # Asked for again when reconciling / verifying - keep it 
+        if station.code not in self.ts_ids:
+            self.ts_ids[station.code] = api.get_timeseries_id(station.id, self.time_series_code)
+        return self.ts_ids[station.code]
+
+    def get_list_of_queries(self, station, df_gaps):
+        frequency = '1D' if self.pacer is None else self.pacer.get_frequency(station.code)
+        return api.get_list_of_queries(df_gaps[['start','end']].copy(), station.log_name, frequency)
+
+    def plan_queries(self, station, df_gaps):
+        # One list of queries per datalogger / log file 
+        return [(unit, self.get_list_of_queries(unit, df_gaps)) for unit in get_retrieval_units(station)]
+
+    def retrieve_units(self, station, units_queries):
+        """
+        Query every datalogger / log file of the station. Loggers on a different 
+        ip / port are queried at the same time, logs on the same logger one after 
+        the other (one telnet session at a time)
+        return:
+            list of records from all the loggers, status message
+        """
+        groups = {}
+        for unit, list_queries in units_queries:
+            groups.setdefault((unit.ip_address, unit.port), []).append((unit, list_queries))
+
+        lock = threading.Lock()
+        records = []
+        statuses = []
+
+        def retrieve_group(group):
+            for unit, list_queries in group:
+                key = get_logger_key(unit)
+                unit_records = []
+                if self.checkpoint is not None:
+                    # Keep what was answered before, only ask for the rest 
+                    unit_records = self.checkpoint.get_records(key)
+                    list_queries = self.checkpoint.get_queries(key, remaining_only=True)
+
+                def query_callback(query, query_records):
+                    unit_records.extend(query_records)
+                    if self.checkpoint is not None:
+                        self.checkpoint.set_query_done(key, query, query_records)
+
+                status = 'Good'
+                if list_queries:
+                    df, unit, status = self.get_gap_data(unit, list_queries, query_callback)
+                with lock:
+                    records.extend(unit_records)
+                    statuses.append((key, status))
+
+        if len(groups) == 1:
+            retrieve_group(list(groups.values())[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                list(executor.map(retrieve_group, groups.values()))
+
+        if len(statuses) == 1:
+            return records, statuses[0][1]
+        if all(status == 'Good' for key, status in statuses):
+            return records, 'Good'
+        return records, '; '.join(f'{key}: {status}' for key, status in sorted(statuses))
+
+    def format(self, item):
+        station, df = item
+        # Resuming - the messages are built again from all the records answered so far 
+        # (set_messages keeps the ones acknowledged before so they are not sent twice)
+        # Only send what IWLS does not have yet 
+        if self.reconcile:
+            ts_id = self.get_timeseries_id(station)
+            if ts_id is not None:
+                df, redundant = reconcile_gap_data(station, df, ts_id)
+                if df.empty:
+                    self.set_result(station, 'format', 'Already in IWLS', redundant=redundant)
+                    return None
+                self.set_result(station, 'format', 'Reconciled', redundant=redundant)
+
+        messages = api.pack_messages(station.code, station.sutron_sensors, station.iwls_sensors,
+                                     df, station.region_header, self.max_bytes, self.max_rows)
+        if not messages:
+            self.set_result(station, 'format', 'No messages')
+            return None
+        if self.checkpoint is not None:
+            self.checkpoint.set_messages(station.code, messages)
+        self.set_result(station, 'format', 'Messages created', messages=len(messages))
+        return station, messages
+
+    def send(self, item):
+        station, messages = item
+        env = self.iwls_environment or station.iwls_environment
+
+        # Only send what was not acknowledged in a previous attempt 
+        list_idx = list(range(len(messages)))
+        if self.checkpoint is not None:
+            list_idx = [idx for idx, message in self.checkpoint.get_messages(station.code, unacknowledged_only=True)]
+        to_send = [messages[idx] for idx in list_idx]
+
+        if not to_send:
+            df = None
+        elif self.outbox is not None:
+            self.outbox.add_messages(to_send, env)
+            df = self.outbox.drain(env, station_code=station.code)
+        else:
+            df = api.send_messages_to_IWLS_bulk(to_send, env)
+
+        if self.checkpoint is not None:
+            for idx in list_idx:
+                if self.outbox is not None:
+                    acknowledged = self.outbox.get_message_status(messages[idx], env) == 'SENT'
+                else:
+                    acknowledged = bool(df.loc[df.message_index == list_idx.index(idx), 'success'].any())
+                if acknowledged:
+                    self.checkpoint.set_message_acknowledged(station.code, idx)
+            unacknowledged = self.checkpoint.get_messages(station.code, unacknowledged_only=True)
+            sent = len(messages) - len(unacknowledged)
+        else:
+            sent = 0 if df is None else int(df['success'].sum())
+
+        self.set_result(station, 'send', 'Good' if sent == len(messages) else 'Send failed', sent=sent)
+
+        # Did the gaps close ? Checked by verify_sent, not here - waiting for IWLS 
+        # would hold up a send worker 
+        if self.verify and sent:
+            with self.lock:
+                self.to_verify.append((station, messages, time.monotonic()))
+        return station, df
+
+    def verify_sent(self, wait=True):
+        """
+        Check the gaps again for the stations sent since the last call (see verify_fill)
+        params:
+            wait = wait once so the last station sent had verify_delay seconds to be ingested,
+                   then check them all. If False only the stations sent at least verify_delay
+                   seconds ago are checked, the others are kept for the next call 
+        return:
+            dict {station code: fill dict from verify_fill} of the stations checked
+        """
+        now = time.monotonic()
+        with self.lock:
+            if wait:
+                to_verify, self.to_verify = self.to_verify, []
+            else:
+                to_verify = [item for item in self.to_verify if now - item[2] >= self.verify_delay]
+                self.to_verify = [item for item in self.to_verify if now - item[2] < self.verify_delay]
+        if not to_verify:
+            return {}
+
+        delay = self.verify_delay - (now - max(sent for station, messages, sent in to_verify))
+        if delay > 0:
+            time.sleep(delay)
+
+        def verify_station(item):
+            station, messages, sent = item
+            ts_id = self.get_timeseries_id(station)
+            fill = None if ts_id is None else verify_fill(station, messages, ts_id)
+            if fill is not None:
+                with self.lock:
+                    self.results[station.code].update(fill)
+                logging.info(f'{station.officialName} {station.code}: {fill["rows_filled"]} of '
+                             f'{fill["rows_sent"]} rows sent are in IWLS (fill ratio {fill["fill_ratio"]})')
+            return station.code, fill
+
+        with ThreadPoolExecutor(max_workers=self.workers['gaps']) as executor:
+            return {code: fill for code, fill in executor.map(verify_station, to_verify) if fill is not None}
+
+    ##--------------------------------------------------------------------------------
+    def worker(self, stage, func, q_in, q_out):
+        stats = self.stats[stage]
+        while True:
+            item = q_in.get()
+            if item is None:
+                # No more work for this stage 
+                break
+
+            start = time.perf_counter()
+            error = False
+            try:
+                result = func(item)
+            except Exception as e:
+                station = item if stage == 'gaps' else item[0]
+                logging.info(f'{station.code} {stage}: {e}')
+                self.set_result(station, stage, f'Error: {e}')
+                result = None
+                error = True
+            busy = time.perf_counter() - start
+
+            with self.lock:
+                stats['items'] += 1
+                stats['busy_seconds'] += busy
+                stats['last_done'] = time.perf_counter()
+                if result is None:
+                    stats['dropped'] += 1
+
+            # Station finished - a resumed run can skip it. Anything that failed (send, 
+            # telnet, errors) stays pending so the resumed run tries it again 
+            station = item if stage == 'gaps' else item[0]
+            status = self.results.get(station.code, {}).get('status')
+            if self.checkpoint is not None and not error and \
+                    ((stage == 'send' and status == 'Good') or status in self.DONE_STATUSES):
+                self.checkpoint.set_station(station.code, stage, status, done=True)
+
+            if result is not None and q_out is not None:
+                q_out.put(result)
+
+    def run(self, stations):
+        """
+        Run all stations through the pipeline
+        params:
+            stations = list of metadata dicts (get_all_metadata_for_key_value)
+                       or StationMetaData objects (get_all_metadata)
+        return:
+            Pandas dataframe with one row per station: last stage reached, status and counts
+        """
+        self.results = {}
+        funcs = {'gaps': self.find_gaps, 'telnet': self.retrieve,
+                 'format': self.format, 'send': self.send}
+        queues = {stage: queue.Queue(maxsize=self.queue_size) for stage in self.STAGES}
+
+        threads = {}
+        run_start = time.perf_counter()
+        for idx, stage in enumerate(self.STAGES):
+            self.stats[stage] = {'workers': self.workers[stage], 'items': 0, 'dropped': 0,
+                                 'busy_seconds': 0.0, 'last_done': run_start}
+            q_out = queues[self.STAGES[idx + 1]] if idx + 1 < len(self.STAGES) else None
+            threads[stage] = [threading.Thread(target=self.worker, daemon=True,
+                                               args=(stage, funcs[stage], queues[stage], q_out))
+                              for i in range(self.workers[stage])]
+            for t in threads[stage]:
+                t.start()
+
+        # Feed the first stage - blocks when the gap finders fall behind 
+        done_stations = set() if self.checkpoint is None else self.checkpoint.get_done_stations()
+        for station in stations:
+            station = get_station_object(station)
+            if station.code in done_stations:
+                continue
+            queues['gaps'].put(station)
+
+        # Shut down one stage at a time - once all workers of a stage are 
+        # done, nothing more can arrive at the next stage 
+        for stage in self.STAGES:
+            for t in threads[stage]:
+                queues[stage].put(None)
+            for t in threads[stage]:
+                t.join()
+
+        for stage in self.STAGES:
+            self.stats[stage]['seconds'] = self.stats[stage].pop('last_done') - run_start
+
+        # All sent - check the gaps of the stations sent 
+        self.verify_sent()
+
+        # Only a run where every station finished is complete - otherwise it can be resumed 
+        if self.checkpoint is not None:
+            codes = set(get_station_object(station).code for station in stations)
+            if codes <= self.checkpoint.get_done_stations():
+                self.checkpoint.complete_run()
+
+        return pd.DataFrame(list(self.results.values()))
+
+    def get_stats(self):
+        """
+        Per stage throughput for the last run
+        return:
+            Pandas dataframe with columns stage, workers, items, dropped, busy_seconds, seconds, items_per_minute
+        """
+        df = pd.DataFrame([{'stage': stage, **self.stats[stage]} for stage in self.STAGES if stage in self.stats])
+        if df.empty:
+            return df
+        df['items_per_minute'] = (df['items'] / df['seconds'].clip(lower=0.001) * 60).round(1)
+        df['busy_seconds'] = df['busy_seconds'].round(1)
+        df['seconds'] = df['seconds'].round(1)
+        return df
+
+# ---------------------------------------------------------------------------------------
+# Persistent gap index between scheduler cycles 
+# get_data_gaps returns every gap in the look back window, including gaps that can 
+# never be filled (dead sensor, data overwritten in the logger). The index remembers
+# each gap so only new gaps, or gaps whose back off has expired, are sent to the loggers.
+# ---------------------------------------------------------------------------------------
+class GapIndex:
+    """
+    SQLite index of gaps per station and time series
+
+    A gap found in a cycle is the same gap as an open gap of the station / series 
+    it overlaps - a dead sensor gap that grows up to now, or an old gap clipped by 
+    the look back window, keeps its attempts and back off. A gap that overlaps 
+    nothing is a new gap. After each failed attempt the next attempt is pushed 
+    back: base_minutes * 2 ** (failures - 1), up to max_minutes.
+
+    Usage:
+        index = GapIndex('gapfill_gaps.db')
+        df_due = index.update(station_code, 'wlo', df_gaps)   # gaps worth querying
+        ...
+        index.record_attempt(station_code, 'wlo', df_due, df_data)
+    """
+
+    def __init__(self, db_file='gapfill_gaps.db', base_minutes=60, max_minutes=7*24*60):
+        self.db_file = db_file
+        self.base_minutes = base_minutes
+        self.max_minutes = max_minutes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tracked_gaps (
+                gap_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                station_code TEXT NOT NULL,
+                series_code TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                missing INTEGER,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                open INTEGER NOT NULL DEFAULT 1,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                last_attempt TEXT,
+                last_outcome TEXT,
+                next_attempt TEXT
+            )""")
+        self.conn.execute('CREATE INDEX IF NOT EXISTS tracked_gaps_station ON tracked_gaps (station_code, series_code, open)')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, station_code, series_code, df_gaps, now=None):
+        """
+        Merge the gaps found this cycle into the index
+        params:
+            df_gaps = dataframe from get_data_gaps (start, end, numberOfMissingData), None if no gaps
+        return:
+            dataframe of the gaps to query now (new gaps and gaps whose back off has expired)
+            with columns gap_id, start, end, numberOfMissingData
+        """
+        now = (now or datetime.utcnow()).strftime('%Y-%m-%dT%H:%M:%SZ')
+        rows = []
+        if df_gaps is not None:
+            for index, gap in df_gaps.iterrows():
+                rows.append((gap['start'].strftime('%Y-%m-%dT%H:%M:%SZ'),
+                             gap['end'].strftime('%Y-%m-%dT%H:%M:%SZ'),
+                             int(gap['numberOfMissingData'])))
+
+        with self.lock:
+            stored = self.conn.execute('SELECT gap_id, start, end FROM tracked_gaps WHERE station_code = ? '
+                                       'AND series_code = ? AND open = 1 ORDER BY start',
+                                       (station_code, series_code)).fetchall()
+            seen = set()
+            for start, end, missing in sorted(rows):
+                # Same gap as an open one it overlaps (its start / end moved) 
+                gap_id = next((id for id, s, e in stored if id not in seen and s <= end and e >= start), None)
+                if gap_id is None:
+                    cursor = self.conn.execute(
+                        'INSERT INTO tracked_gaps (station_code, series_code, start, end, missing, first_seen, last_seen) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)', (station_code, series_code, start, end, missing, now, now))
+                    gap_id = cursor.lastrowid
+                else:
+                    self.conn.execute('UPDATE tracked_gaps SET start = ?, end = ?, missing = ?, last_seen = ? '
+                                      'WHERE gap_id = ?', (start, end, missing, now, gap_id))
+                seen.add(gap_id)
+
+            # Gaps not reported any more are closed (filled by us, GOES, etc.)
+            self.conn.executemany('UPDATE tracked_gaps SET open = 0 WHERE gap_id = ?',
+                                  [(id,) for id, s, e in stored if id not in seen])
+            self.conn.commit()
+            due = self.conn.execute(
+                'SELECT gap_id, start, end, missing FROM tracked_gaps WHERE station_code = ? AND series_code = ? '
+                'AND open = 1 AND (next_attempt IS NULL OR next_attempt <= ?) ORDER BY start DESC',
+                (station_code, series_code, now)).fetchall()
+
+        df = pd.DataFrame(due, columns=['gap_id','start','end','numberOfMissingData'])
+        df['start'] = pd.to_datetime(df['start'], format='%Y-%m-%dT%H:%M:%SZ')
+        df['end'] = pd.to_datetime(df['end'], format='%Y-%m-%dT%H:%M:%SZ')
+        return df
+
+    def record_attempt(self, station_code, series_code, df_gaps, df_data, now=None):
+        """
+        Record the outcome of querying the logger for the gaps
+        params:
+            df_gaps = gaps that were queried (from update, with gap_id)
+            df_data = dataframe from gap_data_formatter, None if nothing came back
+        return:
+            dict of outcome counts i.e. {'recovered': 3, 'no data': 1}
+        """
+        now = now or datetime.utcnow()
+        dates = pd.Series(dtype='datetime64[ns]')
+        if df_data is not None and not df_data.empty:
+            dates = pd.to_datetime(df_data['WaterLevelDate'], format='%m/%d/%Y %H:%M:%S')
+
+        outcomes = {}
+        with self.lock:
+            for index, gap in df_gaps.iterrows():
+                if df_data is None:
+                    outcome = 'failed'
+                elif ((dates >= gap['start']) & (dates <= gap['end'])).any():
+                    outcome = 'recovered'
+                else:
+                    outcome = 'no data'
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+                gap_id = int(gap['gap_id'])
+                if outcome == 'recovered':
+                    # Try again next cycle if IWLS still reports it - the rest may come in 
+                    self.conn.execute('UPDATE tracked_gaps SET attempts = attempts + 1, failures = 0, last_attempt = ?, '
+                                      'last_outcome = ?, next_attempt = NULL WHERE gap_id = ?',
+                                      (now.strftime('%Y-%m-%dT%H:%M:%SZ'), outcome, gap_id))
+                else:
+                    row = self.conn.execute('SELECT failures FROM tracked_gaps WHERE gap_id = ?', (gap_id,)).fetchone()
+                    failures = (row[0] if row else 0) + 1
+                    minutes = min(self.base_minutes * 2 ** (failures - 1), self.max_minutes)
+                    next_attempt = now + timedelta(minutes=minutes)
+                    self.conn.execute('UPDATE tracked_gaps SET attempts = attempts + 1, failures = ?, last_attempt = ?, '
+                                      'last_outcome = ?, next_attempt = ? WHERE gap_id = ?',
+                                      (failures, now.strftime('%Y-%m-%dT%H:%M:%SZ'), outcome,
+                                       next_attempt.strftime('%Y-%m-%dT%H:%M:%SZ'), gap_id))
+            self.conn.commit()
+        return outcomes
+
+    def get_gaps(self, station_code=None, open_only=True):
+        """
+        return:
+            Pandas dataframe of the gaps in the index
+        """
+        sql = 'SELECT * FROM tracked_gaps WHERE 1 = 1'
+        params = []
+        if station_code is not None:
+            sql += ' AND station_code = ?'
+            params.append(station_code)
+        if open_only:
+            sql += ' AND open = 1'
+        with self.lock:
+            cursor = self.conn.execute(sql + ' ORDER BY station_code, series_code, start', params)
+            columns = [c[0] for c in cursor.description]
+            rows = cursor.fetchall()
+        return pd.DataFrame(rows, columns=columns)
+
+# ---------------------------------------------------------------------------------------
+# Priority scheduler for continuous gap filling 
+# Every cadence the gaps are re-checked for all stations and the stations are
+# queued by priority. A fixed number of workers (global concurrency) take the 
+# highest priority station from the queue. Once a station has been attempted it 
+# is left alone for the cool down period.
+# ---------------------------------------------------------------------------------------
+class GapFillScheduler:
+    """
+    Long running gap fill scheduler
+
+    Priority is the expected number of rows recovered per minute of logger time
+        missing points * success rate * age weight / expected minutes
+    where
+        success rate = (successes + 1) / (attempts + 2) from previous attempts
+        age weight = 1 + age of the oldest gap / look back window 
+                     (older gaps are closer to being overwritten in the logger)
+        expected minutes = average minutes of previous attempts (default_minutes if none)
+
+    Usage:
+        scheduler = GapFillScheduler(iwls_environment='prod', region='PAC', outbox=MessageOutbox())
+        scheduler.run_forever()
+    """
+
+    def __init__(self, key='ip_enabled', value='True', iwls_environment='prod', region=None,
+                 look_back_hours=72, cadence_minutes=30, cooldown_minutes=120,
+                 station_refresh_minutes=360, max_concurrency=8, gap_workers=4,
+                 time_series_code='wlo', default_minutes=2.0, outbox=None, gap_index=None, health=None,
+                 pacer=None, sensor_map=None, reconcile=False, verify=False, verify_delay=300, skip_statuses=None):
+        """
+        params:
+            key, value, region = stations to fill, see get_all_metadata_for_key_value
+            iwls_environment = one of "dev","test","prod"
+            look_back_hours = gap window ends now and starts look_back_hours ago
+            cadence_minutes = how often the gaps are re-checked
+            cooldown_minutes = minimum time between two attempts on the same station
+            station_refresh_minutes = how often the list of stations is refreshed
+            max_concurrency = maximum number of stations being filled at the same time
+            gap_workers = number of workers checking for gaps
+            time_series_code = time series to look for gaps in 
+            default_minutes = expected minutes for a station never attempted before
+            outbox = MessageOutbox - if given messages are stored there before sending
+            gap_index = GapIndex - if given only new gaps and gaps whose back off expired are queried
+            health = StationHealth - if given stations with an open circuit are not queued
+            pacer = QueryPacer - if given queries are sized and paced for each station
+            sensor_map = SensorMapCache - if given the sensor map is checked against the .bas file in the logger
+            reconcile, verify = see GapFillPipeline
+            verify_delay = seconds a station is left for IWLS to ingest the messages before it is 
+                           verified - the stations sent are verified at the start of the next 
+                           cycle that is at least verify_delay after the send (no worker waits)
+            skip_statuses = IWLS station status values (get_status_many) of stations not to queue
+        """
+        self.key = key
+        self.value = value
+        self.iwls_environment = iwls_environment
+        self.region = region
+        self.look_back_hours = look_back_hours
+        self.cadence_minutes = cadence_minutes
+        self.cooldown_minutes = cooldown_minutes
+        self.station_refresh_minutes = station_refresh_minutes
+        self.max_concurrency = max_concurrency
+        self.gap_workers = gap_workers
+        self.time_series_code = time_series_code
+        self.default_minutes = default_minutes
+        self.gap_index = gap_index
+        self.skip_statuses = skip_statuses
+
+        # Reuse the pipeline stages for the actual work 
+        self.health = health
+        self.pipeline = GapFillPipeline(None, None, iwls_environment, time_series_code, outbox=outbox,
+                                        health=health, pacer=pacer, sensor_map=sensor_map,
+                                        reconcile=reconcile, verify=verify, verify_delay=verify_delay)
+
+        self.lock = threading.Lock()
+        self.stations = {}
+        self.stations_refreshed = None
+        self.history = {}
+        self.queue = queue.PriorityQueue()
+        self.queued = {}
+        self.running = set()
+        self.sequence = 0
+        self.stop_event = threading.Event()
+
+    ##--------------------------------------------------------------------------------
+    def refresh_stations(self):
+        """
+        Get the stations for key / value again so new stations are picked up 
+        without a restart (and disabled stations are dropped)
+        """
+        # get_all_metadata_for_key_value caches the station list - new stations 
+        # would not be found in the old list 
+        api.list_stations = []
+        list_metadata = api.get_all_metadata_for_key_value(self.key, self.value, self.iwls_environment, self.region)
+
+        stations = {}
+        for m in list_metadata:
+            station = get_station_object(m)
+            stations[station.code] = station
+
+        # Time series ids for all the stations in one go - the gap checks then 
+        # skip the time series listing for each station 
+        api.build_timeseries_directory([station.id for station in stations.values()], refresh=True)
+
+        new_codes = set(stations) - set(self.stations)
+        if self.stations and new_codes:
+            logging.info(f'Scheduler: new stations {sorted(new_codes)}')
+        with self.lock:
+            self.stations = stations
+            self.stations_refreshed = datetime.utcnow()
+
+    def get_history(self, station_code):
+        return self.history.setdefault(station_code, {'attempts': 0, 'successes': 0, 'rows': 0,
+                                                      'seconds': 0.0, 'last_attempt': None,
+                                                      'last_status': '', 'fill_ratio': None})
+
+    def in_cooldown(self, station_code, now):
+        last_attempt = self.get_history(station_code)['last_attempt']
+        if last_attempt is None:
+            return False
+        return now - last_attempt < timedelta(minutes=self.cooldown_minutes)
+
+    def get_priority(self, station_code, df_gaps, now):
+        """
+        Expected rows recovered per minute of logger time - see class docstring 
+        """
+        history = self.get_history(station_code)
+        missing = float(df_gaps['numberOfMissingData'].sum())
+        success_rate = (history['successes'] + 1) / (history['attempts'] + 2)
+
+        oldest_gap_hours = (now - df_gaps['start'].min()).total_seconds() / 3600
+        age_weight = 1 + max(0.0, oldest_gap_hours) / self.look_back_hours
+
+        if history['attempts']:
+            minutes = history['seconds'] / 60 / history['attempts']
+        else:
+            minutes = self.default_minutes
+        return missing * success_rate * age_weight / max(minutes, 0.1)
+
+    def find_gaps(self, station, start_time, end_time):
+        ts_id = api.get_timeseries_id(station.id, self.time_series_code)
+        if ts_id is None:
+            return None
+        df_gaps = api.get_data_gaps(station.id, ts_id, start_time, end_time)
+
+        # Only keep the gaps worth asking the logger for 
+        if self.gap_index is not None:
+            df_gaps = self.gap_index.update(station.code, self.time_series_code, df_gaps)
+        return df_gaps
+
+    def retry_outbox(self):
+        """
+        Put the FAILED outbox messages back to PENDING (capped, see MessageOutbox.retry_failed) 
+        and send them again
+        return:
+            number of messages sent again
+        """
+        outbox = self.pipeline.outbox
+        if outbox is None:
+            return 0
+        requeued = outbox.retry_failed(capped=True)
+        if requeued:
+            logging.info(f'Scheduler: sending {requeued} failed outbox messages again')
+            try:
+                outbox.drain(self.iwls_environment, max_workers=self.max_concurrency)
+            except Exception as e:
+                # They stay PENDING and go with the next send of the station 
+                logging.info(f'Scheduler: outbox drain failed: {e}')
+        return requeued
+
+    def check_gaps(self):
+        """
+        Re-check the gaps for all stations not running or cooling down and queue them by priority
+        return:
+            number of stations queued
+        """
+        now = datetime.utcnow()
+        if (self.stations_refreshed is None or
+                now - self.stations_refreshed >= timedelta(minutes=self.station_refresh_minutes)):
+            self.refresh_stations()
+
+        end_time = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+        start_time = (now - timedelta(hours=self.look_back_hours)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        # Messages that failed in an earlier cycle get another go (up to max_requeues times)
+        self.retry_outbox()
+
+        # Stations sent in an earlier cycle - did the gaps close ? 
+        for code, fill in self.pipeline.verify_sent(wait=False).items():
+            with self.lock:
+                self.get_history(code)['fill_ratio'] = fill['fill_ratio']
+
+        with self.lock:
+            candidates = [station for code, station in self.stations.items()
+                          if code not in self.running and not self.in_cooldown(code, now)]
+
+        # No point looking for gaps at stations known to be down 
+        if self.health is not None:
+            candidates = [station for station in candidates
+                          if not all(self.health.is_open(get_logger_key(unit)) for unit in get_retrieval_units(station))]
+
+        # ... or reported as down by IWLS 
+        if self.skip_statuses and candidates:
+            df_status = api.get_status_many([station.id for station in candidates])
+            down = set(df_status.loc[df_status['status'].isin(self.skip_statuses), 'station_id'])
+            if down:
+                logging.info(f'Scheduler: {len(down)} stations skipped for their IWLS status')
+            candidates = [station for station in candidates if station.id not in down]
+
+        def check(station):
+            try:
+                return station, self.find_gaps(station, start_time, end_time)
+            except Exception as e:
+                logging.info(f'Scheduler: {station.code} could not get gaps: {e}')
+                return station, None
+
+        list_priority = []
+        with ThreadPoolExecutor(max_workers=self.gap_workers) as executor:
+            for station, df_gaps in executor.map(check, candidates):
+                if df_gaps is None or df_gaps.empty:
+                    continue
+                list_priority.append((self.get_priority(station.code, df_gaps, now), station.code, df_gaps))
+
+        # Queue the highest priority first so idle workers start on it 
+        list_priority.sort(key=lambda x: x[0], reverse=True)
+        for priority, code, df_gaps in list_priority:
+            with self.lock:
+                # A newer entry replaces any older one still in the queue 
+                self.sequence += 1
+                self.queued[code] = self.sequence
+                self.queue.put((-priority, self.sequence, code, df_gaps))
+
+        logging.info(f'Scheduler: {len(list_priority)} stations queued from {len(candidates)} checked')
+        return len(list_priority)
+
+    def fill_station(self, station, df_gaps):
+        """
+        Fill the gaps for one station and keep the history for the priority
+        """
+        start = time.perf_counter()
+        rows = 0
+        status = ''
+        try:
+            units_queries = self.pipeline.plan_queries(station, df_gaps)
+            item = self.pipeline.retrieve((station, units_queries))
+            if self.gap_index is not None:
+                df_data = None if item is None else item[1]
+                self.gap_index.record_attempt(station.code, self.time_series_code, df_gaps, df_data)
+            if item is not None:
+                rows = len(item[1])
+                item = self.pipeline.format(item)
+            if item is not None:
+                # Verified in a later cycle (check_gaps) once IWLS had time to ingest it 
+                self.pipeline.send(item)
+            status = self.pipeline.results.get(station.code, {}).get('status', '')
+        except Exception as e:
+            status = f'Error: {e}'
+            logging.info(f'Scheduler: {station.code} {status}')
+
+        with self.lock:
+            history = self.get_history(station.code)
+            history['attempts'] += 1
+            history['successes'] += 1 if rows else 0
+            history['rows'] += rows
+            history['seconds'] += time.perf_counter() - start
+            history['last_attempt'] = datetime.utcnow()
+            history['last_status'] = status
+        logging.info(f'Scheduler: {station.code} {status} rows={rows}')
+
+    def worker(self):
+        while not self.stop_event.is_set():
+            try:
+                priority, sequence, code, df_gaps = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                # Skip old entries and stations that left the list 
+                if self.queued.get(code) != sequence or code not in self.stations:
+                    continue
+                del self.queued[code]
+                self.running.add(code)
+                station = self.stations[code]
+
+            try:
+                self.fill_station(station, df_gaps)
+            finally:
+                with self.lock:
+                    self.running.discard(code)
+
+    def get_history_df(self):
+        """
+        History of attempts for each station
+        return:
+            Pandas dataframe with columns code, attempts, successes, rows, seconds, last_attempt, last_status,
+            fill_ratio (of the last send, once verified)
+        """
+        with self.lock:
+            return pd.DataFrame([{'code': code, **h} for code, h in sorted(self.history.items())])
+
+    def run_forever(self):
+        """
+        Start the workers and re-check the gaps every cadence_minutes until stop() is called
+        """
+        workers = [threading.Thread(target=self.worker, daemon=True) for i in range(self.max_concurrency)]
+        for t in workers:
+            t.start()
+
+        while not self.stop_event.is_set():
+            try:
+                self.check_gaps()
+            except Exception as e:
+                logging.info(f'Scheduler: could not check gaps: {e}')
+            self.stop_event.wait(self.cadence_minutes * 60)
+
+        for t in workers:
+            t.join()
+
+    def stop(self):
+        self.stop_event.set()
+
+##--------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Fill IWLS data gaps from the station loggers')
+    parser.add_argument('--environment', default='prod', help='one of dev, test, prod')
+    parser.add_argument('--region', default=None, help='one of ATL, CNA, PAC, QUE (default all)')
+    parser.add_argument('--key', default='ip_enabled', help='key used to select the stations')
+    parser.add_argument('--value', default='True', help='value used to select the stations')
+    parser.add_argument('--hours', type=int, default=72, help='look back window in hours')
+    parser.add_argument('--state', default='gapfill_state.db', help='checkpoint database')
+    parser.add_argument('--outbox', default=None, help='outbox database (default send directly)')
+    parser.add_argument('--reconcile', action='store_true', help='do not send rows IWLS already has')
+    parser.add_argument('--verify', action='store_true', help='check the gaps again after sending')
+    parser.add_argument('--resume', nargs='?', const='latest', default=None, metavar='RUN_ID',
+                        help='continue the latest unfinished run (or RUN_ID)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    checkpoint = GapFillCheckpoint(args.state)
+    if args.resume is not None:
+        run = checkpoint.resume_run(None if args.resume == 'latest' else args.resume)
+        if run is None:
+            print('No run to resume')
+            return
+        start_time, end_time, iwls_environment = run
+    else:
+        now = datetime.utcnow()
+        end_time = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+        start_time = (now - timedelta(hours=args.hours)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        iwls_environment = args.environment
+        checkpoint.new_run(start_time, end_time, iwls_environment)
+    print(f'Run {checkpoint.run_id}: {start_time} to {end_time} ({iwls_environment})')
+
+    stations = api.get_all_metadata_for_key_value(args.key, args.value, iwls_environment, args.region)
+    outbox = MessageOutbox(args.outbox) if args.outbox else None
+
+    pipeline = GapFillPipeline(start_time, end_time, iwls_environment, outbox=outbox, checkpoint=checkpoint,
+                               reconcile=args.reconcile, verify=args.verify, verify_delay=30 if args.verify else 0)
+    df = pipeline.run(stations)
+    if not df.empty:
+        print(df.to_string(index=False))
+    print(pipeline.get_stats().to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,458 @@
+"""Sutron_Simulator
+
+DFO-MPO/CHS-SHC
+Institute of Ocean Sciences / Institut des sciences de la mer
+
+Local TCP simulator of a Sutron 8310 datalogger so the telnet path
+(get_gap_data_from_station, station_response_enforcer, gap_data_formatter)
+can be run and timed without a real station.
+
+The simulator speaks the same dialogue as the logger:
+    Login user:                         (only if a username is set)
+    \\Flash Disk>
+    get /S 05-14-2020 16:00 /E 05-14-2020 17:00 /ny /c /csv
+    get /F ssp.log /S ... /E ... /ny /c /csv
+    DIR 07120_MEAS_IPtoIWLS.bas
+    TYPE 07120_MEAS_IPtoIWLS.bas /C
+and answers the get queries with a CSV log for its sensors
+    05/14/2020,16:29:00,PWL1,2.828,m,G
+
+Faults can be injected - latency, a bandwidth limit, garbled echoes
+(the enforcer rejects the reply) and dropped connections.
+
+Run from the project folder to start 200 loggers and time a concurrent retrieval:
+    python -m utilities.Sutron_Simulator --count 200 --latency 0.5 --bandwidth 2000 --benchmark
+
+This file can be imported as a module and contains the following
+classes and functions:
+
+    * SutronSimulator - one simulated logger listening on a local port
+    * SimulatorFarm - starts / stops many simulated loggers
+    * get_station_object - returns a StationMetaData object pointing at a simulated logger
+    * run_benchmark - retrieves from all the loggers of a farm at the same time and returns the timings
+
+"""
+
+# Standard imports
+import argparse
+import math
+import random
+import socketserver
+import threading
+import time
+import logging
+import pandas as pd
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from . import IWLS_API_Tools as api
+
+# Sensor name: (units, mean, amplitude) - water levels follow a semi-diurnal tide
+DEFAULT_SENSORS = {'PWL1': ('m', 2.5, 1.5),
+                   'PWL2': ('m', 2.5, 1.5),
+                   'SPS': ('', 8.8, 0.0)}
+
+# M2 tide period in hours
+TIDE_PERIOD_HOURS = 12.42
+
+PROMPT = b'\\Flash Disk>'
+
+# ---------------------------------------------------------------------------------------
+# One simulated logger
+# ---------------------------------------------------------------------------------------
+class SutronSimulator:
+    """
+    Simulated Sutron 8310 datalogger on a local TCP port
+
+    Usage:
+        logger = SutronSimulator('07120', latency=0.5)
+        logger.start()
+        metadata = get_station_object(logger)
+        df, metadata, status = api.get_gap_data_from_station(metadata, list_queries, 0)
+        logger.stop()
+    """
+
+    def __init__(self, station_code='07120', sensors=None, host='127.0.0.1', port=0,
+                 username=None, password=None, interval_minutes=1, log_names=None,
+                 basic_file_name=None, latency=0.0, bytes_per_second=None,
+                 garble_rate=0.0, drop_rate=0.0, seed=None):
+        """
+        params:
+            station_code = station code used in the file names
+            sensors = dict of sensor name: (units, mean, amplitude), see DEFAULT_SENSORS
+            host, port = where to listen (port 0 picks a free port)
+            username, password = if given the logger asks for them (Login user:)
+            interval_minutes = logging interval of all the sensors
+            log_names = log files that can be asked for with /F (None accepts any)
+            basic_file_name = .bas push file returned by DIR / TYPE (default <code>_MEAS_IPtoIWLS.bas)
+            latency = seconds before each answer
+            bytes_per_second = bandwidth limit of the answers (None for no limit)
+            garble_rate = fraction of the answers with a garbled echo of the query
+            drop_rate = fraction of the answers where the connection is dropped half way
+            seed = random seed so a run can be repeated
+        """
+        self.station_code = station_code
+        self.sensors = dict(DEFAULT_SENSORS if sensors is None else sensors)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.interval_minutes = interval_minutes
+        self.log_names = log_names
+        self.basic_file_name = basic_file_name or f'{station_code}_MEAS_IPtoIWLS.bas'
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.garble_rate = garble_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.modified = datetime.utcnow()
+
+        self.server = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {'connections': 0, 'queries': 0, 'records': 0, 'bytes_sent': 0,
+                      'garbled': 0, 'dropped': 0}
+
+    ##--------------------------------------------------------------------------------
+    def start(self):
+        simulator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                simulator.handle(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def add_stat(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    ##--------------------------------------------------------------------------------
+    # The dialogue
+    def handle(self, conn):
+        self.add_stat('connections')
+        reader = conn.makefile('rb')
+        try:
+            if self.username is not None:
+                conn.sendall(b'Login user: ')
+                if self.read_line(reader) != self.username or self.read_line(reader) != (self.password or ''):
+                    conn.sendall(b'\r\nAccess denied\r\n')
+                    return
+            conn.sendall(b'\r\n' + PROMPT)
+
+            while True:
+                line = self.read_line(reader)
+                if line is None:
+                    return
+                if line == '':
+                    continue
+                if not self.answer(conn, line):
+                    return
+        except (ConnectionError, OSError):
+            # Client went away
+            return
+        finally:
+            reader.close()
+            conn.close()
+
+    def read_line(self, reader):
+        # Commands end with \r (login) or \r\n (queries)
+        line = b''
+        while True:
+            c = reader.read(1)
+            if not c:
+                return None if not line else line.decode('utf-8', errors='ignore')
+            if c in b'\r\n':
+                # the \n of \r\n comes back as an empty line
+                return line.decode('utf-8', errors='ignore')
+            line += c
+
+    def answer(self, conn, command):
+        """
+        Answer one command
+        return:
+            False if the connection was dropped
+        """
+        words = command.split()
+        verb = words[0].lower()
+        if verb == 'get':
+            body = self.get_log(words)
+        elif verb == 'dir':
+            body = self.get_dir(words)
+        elif verb == 'type':
+            body = self.get_type(words)
+        elif verb in ('quit', 'exit', 'bye'):
+            return False
+        else:
+            body = ['Unknown command']
+
+        echo = command
+        if verb == 'get':
+            self.add_stat('queries')
+            if self.random.random() < self.garble_rate:
+                # Noisy line - the echo does not match the query anymore
+                self.add_stat('garbled')
+                echo = ''.join(c if self.random.random() > 0.2 else '#' for c in command) + '~'
+
+        reply = ('\r\n'.join([echo] + body + [''])).encode('utf-8') + PROMPT
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if verb == 'get' and self.random.random() < self.drop_rate:
+            self.add_stat('dropped')
+            self.send(conn, reply[:len(reply) // 2])
+            return False
+
+        self.send(conn, reply)
+        return True
+
+    def send(self, conn, data):
+        if not self.bytes_per_second:
+            conn.sendall(data)
+        else:
+            # Send in small chunks to keep to the bandwidth
+            chunk = max(1, int(self.bytes_per_second / 10))
+            for i in range(0, len(data), chunk):
+                conn.sendall(data[i:i + chunk])
+                time.sleep(len(data[i:i + chunk]) / self.bytes_per_second)
+        self.add_stat('bytes_sent', len(data))
+
+    ##--------------------------------------------------------------------------------
+    # The logger content
+    def get_log(self, words):
+        # get [/F log] /S mm-dd-yyyy HH:MM /E mm-dd-yyyy HH:MM /ny /c /csv
+        try:
+            options = {}
+            i = 1
+            while i < len(words):
+                word = words[i].lower()
+                if word in ('/s', '/e'):
+                    options[word] = datetime.strptime(words[i + 1] + ' ' + words[i + 2], '%m-%d-%Y %H:%M')
+                    i += 3
+                elif word == '/f':
+                    options[word] = words[i + 1]
+                    i += 2
+                else:
+                    i += 1
+            start = options['/s']
+            end = options['/e']
+        except (IndexError, KeyError, ValueError):
+            return ['Invalid command arguments']
+
+        log_name = options.get('/f')
+        if (log_name is not None) and (self.log_names is not None) and (log_name not in self.log_names):
+            return ['File not found.']
+
+        return self.get_records(start, end)
+
+    def get_records(self, start, end):
+        # One record per sensor per logging interval, from start to end inclusive
+        records = []
+        step = timedelta(minutes=self.interval_minutes)
+        t = start
+        while t <= end:
+            hours = (t - datetime(2000, 1, 1)).total_seconds() / 3600
+            for sensor, (units, mean, amplitude) in self.sensors.items():
+                value = mean + amplitude * math.sin(2 * math.pi * hours / TIDE_PERIOD_HOURS)
+                records.append(f'{t:%m/%d/%Y},{t:%H:%M:%S},{sensor},{value:.3f},{units},G')
+            t += step
+        self.add_stat('records', len(records))
+        return records
+
+    def get_bas(self):
+        # Just enough of a push file for get_stations_as_lists
+        lines = [f'\' {self.basic_file_name} - simulated']
+        for i, sensor in enumerate(self.sensors, start=1):
+            lines.append(f'SENSOR{i} = "{sensor}"')
+            lines.append(f'IWLS{i} = "{sensor}"')
+        return lines
+
+    def get_dir(self, words):
+        file_name = words[1] if len(words) > 1 else ''
+        if file_name.lower() != self.basic_file_name.lower():
+            return ['File not found.']
+        size = len('\r\n'.join(self.get_bas()))
+        return [f'{self.modified:%m/%d/%Y %H:%M:%S} {size:>10} {self.basic_file_name}']
+
+    def get_type(self, words):
+        file_name = words[1] if len(words) > 1 else ''
+        if file_name.lower() != self.basic_file_name.lower():
+            return ['File not found.']
+        return self.get_bas()
+
+    def set_sensors(self, sensors):
+        """
+        Change the sensors - the .bas file changes too (new DIR listing)
+        """
+        self.sensors = dict(sensors)
+        self.modified = datetime.utcnow()
+
+##--------------------------------------------------------------------------------
+def get_station_object(simulator):
+    """
+    StationMetaData object pointing at a simulated logger
+    params:
+        simulator = started SutronSimulator
+    return:
+        StationMetaData object
+    """
+    metadata = api.StationMetaData()
+    metadata.code = simulator.station_code
+    metadata.officialName = f'Simulator {simulator.station_code}'
+    metadata.ip_address = simulator.host
+    metadata.ip = simulator.host
+    metadata.port = simulator.port
+    metadata.user_login = simulator.username
+    metadata.user_pass = simulator.password
+    metadata.basic_file_name = simulator.basic_file_name
+    metadata.script_variable_sensor = 'SENSOR'
+    metadata.script_variable_iwls = 'IWLS'
+    metadata.sutron_sensors = list(simulator.sensors)
+    metadata.iwls_sensors = list(simulator.sensors)
+    metadata.log_name = ''
+    return metadata
+
+# ---------------------------------------------------------------------------------------
+# Many simulated loggers
+# ---------------------------------------------------------------------------------------
+class SimulatorFarm:
+    """
+    Starts and stops many simulated loggers, each on its own port
+
+    Usage:
+        with SimulatorFarm(200, latency=0.5, bytes_per_second=2000) as farm:
+            df = run_benchmark(farm, hours=6)
+    """
+
+    def __init__(self, count, first_code=10000, **kwargs):
+        """
+        params:
+            count = number of loggers
+            first_code = station code of the first logger, the others follow
+            kwargs = passed to each SutronSimulator (latency, bytes_per_second ...)
+        """
+        seed = kwargs.pop('seed', None)
+        self.simulators = [SutronSimulator(f'{first_code + i:05d}',
+                                           seed=None if seed is None else seed + i, **kwargs)
+                           for i in range(count)]
+
+    def start(self):
+        for simulator in self.simulators:
+            simulator.start()
+        logging.info(f'Simulator farm: {len(self.simulators)} loggers started')
+        return self
+
+    def stop(self):
+        for simulator in self.simulators:
+            simulator.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_stations(self):
+        return [get_station_object(simulator) for simulator in self.simulators]
+
+    def get_stats(self):
+        """
+        return:
+            Pandas dataframe with the stats of each logger
+        """
+        rows = []
+        for simulator in self.simulators:
+            row = {'code': simulator.station_code, 'port': simulator.port}
+            row.update(simulator.get_stats())
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+##--------------------------------------------------------------------------------
+def run_benchmark(farm, hours=6, frequency='60min', max_workers=64, sensor_map=None):
+    """
+    Retrieve the last hours from all the loggers of the farm at the same time
+    params:
+        farm = started SimulatorFarm
+        hours = length of the gap asked for
+        frequency = longest span of a single query (see get_list_of_queries)
+        max_workers = number of loggers queried at the same time
+        sensor_map = SensorMapCache passed to get_gap_data_from_station
+    return:
+        Pandas dataframe with columns code, status, rows, seconds
+    """
+    end = pd.Timestamp.utcnow().floor('min')
+    df_gaps = pd.DataFrame({'start': [end - pd.Timedelta(hours=hours)], 'end': [end]})
+
+    def retrieve(station):
+        list_queries = api.get_list_of_queries(df_gaps.copy(), station.log_name, frequency)
+        start = time.perf_counter()
+        df, station, status = api.get_gap_data_from_station(station, list_queries, 0, sensor_map=sensor_map)
+        return {'code': station.code, 'status': status, 'rows': 0 if df is None else len(df),
+                'seconds': round(time.perf_counter() - start, 3)}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(retrieve, farm.get_stations()))
+    logging.info(f'Benchmark: {len(results)} loggers in {time.perf_counter() - start:.1f} s')
+    return pd.DataFrame(results)
+
+##--------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Simulated Sutron 8310 loggers')
+    parser.add_argument('--count', type=int, default=1, help='number of loggers')
+    parser.add_argument('--first-code', type=int, default=10000, help='station code of the first logger')
+    parser.add_argument('--username', default=None, help='ask for this user at login')
+    parser.add_argument('--password', default=None, help='password for the user')
+    parser.add_argument('--interval', type=int, default=1, help='logging interval in minutes')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each answer')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes per second (default no limit)')
+    parser.add_argument('--garble', type=float, default=0.0, help='fraction of garbled answers')
+    parser.add_argument('--drop', type=float, default=0.0, help='fraction of dropped connections')
+    parser.add_argument('--seed', type=int, default=None, help='random seed')
+    parser.add_argument('--benchmark', action='store_true', help='retrieve from all loggers and exit')
+    parser.add_argument('--hours', type=int, default=6, help='benchmark gap length in hours')
+    parser.add_argument('--workers', type=int, default=64, help='benchmark loggers queried at the same time')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    farm = SimulatorFarm(args.count, args.first_code, username=args.username, password=args.password,
+                         interval_minutes=args.interval, latency=args.latency,
+                         bytes_per_second=args.bandwidth, garble_rate=args.garble,
+                         drop_rate=args.drop, seed=args.seed)
+    with farm:
+        if args.benchmark:
+            df = run_benchmark(farm, args.hours, max_workers=args.workers)
+            print(df['status'].value_counts().to_string())
+            print(df['seconds'].describe().to_string())
+            print(farm.get_stats()[['queries', 'records', 'bytes_sent', 'garbled', 'dropped']].sum().to_string())
+            return
+
+        for simulator in farm.simulators:
+            print(f'{simulator.station_code} {simulator.host}:{simulator.port}')
+        print('Ctrl+C to stop')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()